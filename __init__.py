@@ -2,15 +2,23 @@ from .mypylib import *
 
 __all__ = [
     "get_hash_md5",
+    "get_file_hash",
+    "FileHasher",
     "Dict",
     "MyPyClass",
+    "DataCodec",
+    "LogFile",
+    "CycleStats",
     "parse",
     "ping",
     "get_request",
+    "HttpClient",
+    "get_http_client",
     "dir",
     "b2mb",
     "search_file_in_dir",
     "search_dir_in_dir",
+    "DirIndex",
     "get_dir_from_path",
     "get_full_name_from_path",
     "print_table",
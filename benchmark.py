@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf_8 -*-
+
+'''
+Benchmarks of mypylib, run from the directory that contains the package:
+	python3 -m mypylib.benchmark import --budget 50
+	python3 -m mypylib.benchmark codec
+	python3 -m mypylib.benchmark dict
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import importlib
+import statistics
+import subprocess
+
+# Must not be imported by `import mypylib`, see LazyModule
+heavy_modules = ["asyncio", "concurrent.futures", "filelock", "http.server", "platform",
+	"psutil", "requests", "subprocess", "tracemalloc", "urllib.request"]
+
+
+def get_import_target():
+	'''return (module name, sys.path entry) for a child interpreter'''
+	package_dir = os.path.dirname(os.path.abspath(__file__))
+	if __package__:
+		return __package__, os.path.dirname(package_dir)
+	return "mypylib", package_dir
+#end define
+
+def measure_import(name, path):
+	'''Cold import in a new interpreter: (time in ms, heavy modules loaded)'''
+	code = (
+		"import sys, time, json\n"
+		f"sys.path.insert(0, {path!r})\n"
+		"start = time.perf_counter()\n"
+		f"import {name}\n"
+		"duration = (time.perf_counter() - start) * 1000\n"
+		f"print(json.dumps([duration, [item for item in {heavy_modules!r} if item in sys.modules]]))\n"
+	)
+	env = dict(os.environ)
+	env.pop("PYTHONDONTWRITEBYTECODE", None)  # measure the import, not the compilation
+	text = subprocess.check_output([sys.executable, "-c", code], text=True, env=env)
+	duration, loaded = json.loads(text)
+	return duration, loaded
+#end define
+
+def bench_import(args):
+	name, path = get_import_target()
+	durations = list()
+	measure_import(name, path)  # warm up the bytecode cache
+	for i in range(args.runs):
+		duration, loaded = measure_import(name, path)
+		durations.append(duration)
+	median = statistics.median(durations)
+	print(f"import {name}: median {median:.1f}ms, min {min(durations):.1f}ms, max {max(durations):.1f}ms ({args.runs} runs)")
+	result = True
+	if loaded:
+		print(f"heavy modules imported eagerly: {', '.join(loaded)}")
+		result = False
+	if args.budget and median > args.budget:
+		print(f"over budget: {median:.1f}ms > {args.budget}ms")
+		result = False
+	return result
+#end define
+
+def get_library():
+	if __package__:
+		return importlib.import_module(".mypylib", __package__)
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	return importlib.import_module("mypylib")
+#end define
+
+def get_state_sample(count):
+	random.seed(1)
+	result = dict()
+	for i in range(count):
+		result[f"wallet_{i}"] = {"address": f"{random.getrandbits(128):032x}", "balance": random.randint(0, 10**12),
+			"status": random.choice(["active", "frozen", "uninit"]), "seqno": i, "history": list(range(i % 20))}
+	return result
+#end define
+
+def bench_codec(args):
+	DataCodec = get_library().DataCodec
+	item = get_state_sample(args.records)
+	size = len(json.dumps(item).encode("utf-8"))
+	configs = [("zlib", 1), ("zlib", None), ("zlib", 9), ("lzma", None), ("zstd", None), (None, None)]
+	table = [["codec", "size", "ratio", "encode MB/s", "decode MB/s"]]
+	for algorithm, level in configs:
+		for base64 in (True, False):
+			codec = DataCodec(algorithm, level, base64=base64)
+			try:
+				start = time.perf_counter()
+				data = codec.encode(item)
+				encode_time = time.perf_counter() - start
+			except Exception as err:
+				print(f"{algorithm}: {err}")
+				break
+			start = time.perf_counter()
+			codec.decode(data)
+			decode_time = time.perf_counter() - start
+			name = f"{algorithm or 'none'}{'' if level is None else ':' + str(level)}{'' if base64 else ' raw'}"
+			table.append([name, len(data), f"{size / len(data):.2f}", f"{size / encode_time / 10**6:.1f}", f"{size / decode_time / 10**6:.1f}"])
+	print(f"payload: {args.records} records, {size} bytes of JSON")
+	print_rows(table)
+
+	# Many small payloads with and without a trained dictionary
+	samples = list(get_state_sample(args.records).values())
+	train, test = samples[:len(samples) // 2], samples[len(samples) // 2:]
+	table = [["small payloads", "total size", "ratio"]]
+	test_size = sum(len(json.dumps(sample).encode("utf-8")) for sample in test)
+	for algorithm in ("zlib", "zstd"):
+		codec = DataCodec(algorithm, base64=False)
+		try:
+			plain = sum(len(codec.encode(sample)) for sample in test)
+			codec.train_dictionary(train)
+		except Exception as err:
+			print(f"{algorithm}: {err}")
+			continue
+		trained = sum(len(codec.encode(sample)) for sample in test)
+		table.append([algorithm, plain, f"{test_size / plain:.2f}"])
+		table.append([f"{algorithm} + dictionary", trained, f"{test_size / trained:.2f}"])
+	print_rows(table)
+	return True
+#end define
+
+def get_best_time(function, *args, repeat=5):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		function(*args)
+		duration = time.perf_counter() - start
+		best = duration if best is None else min(best, duration)
+	return best
+#end define
+
+def write_key(item, number):
+	for i in range(number):
+		item["x"] = i
+#end define
+
+def write_attribute(item, number):
+	for i in range(number):
+		item.x = i
+#end define
+
+def write_nested(item, number):
+	for i in range(number):
+		item["a"]["b"]["c"] = i
+#end define
+
+def bench_dict(args):
+	library = get_library()
+	sample = json.loads(json.dumps(get_state_sample(args.records)))
+	table = [["operation", "dict", "Dict", "TrackedDict", "TrackedDict + tracker"]]
+	build = [f"build {args.records} records, ms", f"{get_best_time(json.loads, json.dumps(sample)) * 1000:.1f}"]
+	build.append(f"{get_best_time(library.Dict, sample) * 1000:.1f}")
+	build.append(f"{get_best_time(library.TrackedDict, sample) * 1000:.1f}")
+	build.append("")
+	table.append(build)
+	for name, function in [("write d[key], us", write_key), ("write d.key, us", write_attribute), ("write d[a][b][c], us", write_nested)]:
+		row = [name]
+		for kind in ("dict", "Dict", "TrackedDict", "tracked"):
+			item = {"a": {"b": {"c": 0}}}
+			if kind == "Dict":
+				item = library.Dict(item)
+			elif kind != "dict":
+				item = library.TrackedDict(item)
+			if kind == "tracked":
+				item._track(library.DictTracker())
+			if kind == "dict" and function is write_attribute:
+				row.append("")
+				continue
+			row.append(f"{get_best_time(function, item, args.writes) / args.writes * 10**6:.2f}")
+		table.append(row)
+	print_rows(table)
+	return True
+#end define
+
+def print_rows(table):
+	widths = [max(len(str(row[i])) for row in table) + 2 for i in range(len(table[0]))]
+	for row in table:
+		print(''.join(str(value).ljust(width) for value, width in zip(row, widths)))
+#end define
+
+def main():
+	parser = argparse.ArgumentParser(prog="python3 -m mypylib.benchmark")
+	commands = parser.add_subparsers(dest="command", required=True)
+	parser_import = commands.add_parser("import", help="cold import time of the library")
+	parser_import.add_argument("--runs", type=int, default=10)
+	parser_import.add_argument("--budget", type=float, default=50, help="median budget in ms, 0 = no limit")
+	parser_import.set_defaults(func=bench_import)
+	parser_codec = commands.add_parser("codec", help="ratio and throughput of DataCodec")
+	parser_codec.add_argument("--records", type=int, default=20000)
+	parser_codec.set_defaults(func=bench_codec)
+	parser_dict = commands.add_parser("dict", help="build and write cost of Dict and TrackedDict")
+	parser_dict.add_argument("--records", type=int, default=20000)
+	parser_dict.add_argument("--writes", type=int, default=200000)
+	parser_dict.set_defaults(func=bench_dict)
+	args = parser.parse_args()
+	result = args.func(args)
+	sys.exit(0 if result else 1)
+#end define
+
+
+if __name__ == "__main__":
+	main()
@@ -2,6 +2,7 @@
 # -*- coding: utf_8 -*-
 
 import atexit
+import bisect
 import os
 import re
 import shutil
@@ -9,164 +10,2483 @@ import sys
 import tempfile
 import time
 import json
+import collections
+import fnmatch
+import functools
+import gc
+import gzip
+import heapq
+import importlib
+import mmap
+import queue
+import random
 
-import filelock
 import zlib
 import signal
 import base64
-import psutil
 import struct
 import socket
 import hashlib
-import platform
-import requests
 import threading
-import subprocess
 import datetime as date_time_library
-from urllib.request import urlopen
+
+
+class LazyModule:
+	'''
+	Stand-in for a module that is imported on first attribute access.
+	After that it replaces itself in the globals of this file, so later
+	lookups go straight to the module
+	'''
+	def __init__(self, name, alias=None):
+		self._name = name
+		self._alias = alias or name
+		self._module = None
+	#end define
+
+	def _load(self):
+		module = self._module
+		if module is None:
+			module = importlib.import_module(self._name)
+			self._module = module
+			if globals().get(self._alias) is self:
+				globals()[self._alias] = module
+		return module
+	#end define
+
+	def __getattr__(self, name):
+		return getattr(self._load(), name)
+	#end define
+
+	def __repr__(self):
+		return f"<lazy module '{self._name}'>"
+	#end define
+#end class
+
+
+# Heavy modules, imported on first use
+asyncio = LazyModule("asyncio")
+concurrent_futures = LazyModule("concurrent.futures", "concurrent_futures")
+filelock = LazyModule("filelock")
+http_client = LazyModule("http.client", "http_client")
+lzma = LazyModule("lzma")
+http_server = LazyModule("http.server", "http_server")
+platform = LazyModule("platform")
+psutil = LazyModule("psutil")
+subprocess = LazyModule("subprocess")
+tracemalloc = LazyModule("tracemalloc")
+urllib_parse = LazyModule("urllib.parse", "urllib_parse")
+urllib_request = LazyModule("urllib.request", "urllib_request")
+
+@functools.lru_cache(maxsize=None)
+def import_optional(name):
+	'''Optional dependency (orjson, ujson, msgpack, zstandard) or None'''
+	try:
+		return importlib.import_module(name)
+	except ImportError:
+		return None
+#end define
 
 INFO = "info"
 WARNING = "warning"
 ERROR = "error"
 DEBUG = "debug"
 
+DEBUG_LEVEL = 10
+INFO_LEVEL = 20
+WARNING_LEVEL = 30
+ERROR_LEVEL = 40
+LOG_LEVELS = {DEBUG: DEBUG_LEVEL, INFO: INFO_LEVEL, WARNING: WARNING_LEVEL, ERROR: ERROR_LEVEL}
+
+scalar_types = frozenset([str, int, float, bool, type(None), bytes])
+
+ansi_escape_pattern = re.compile(r"\033\[[0-9;]*m")
+
+
+class Dict(dict):
+	'''
+	dict with attribute access. Nested dicts are converted to Dict, values
+	stored later are kept as they are
+	'''
+	def __init__(self, *args, **kwargs):
+		for item in args:
+			self._parse_dict(item)
+		self._parse_dict(kwargs)
+	#end define
+
+	def _parse_dict(self, d):
+		setitem = dict.__setitem__
+		for key, value in d.items():
+			if type(value) in scalar_types:
+				pass
+			elif type(value) is dict or isinstance(value, Dict):
+				value = Dict(value)
+			elif isinstance(value, list):
+				value = self._parse_list(value)
+			setitem(self, key, value)
+	#end define
+
+	def _parse_list(self, lst):
+		result = list()
+		for value in lst:
+			if type(value) is dict or isinstance(value, Dict):
+				value = Dict(value)
+			result.append(value)
+		return result
+	#end define
+
+	def __reduce__(self):
+		return (self.__class__, (dict(self),))
+	#end define
+
+	def __setattr__(self, key, value):
+		self[key] = value
+	#end define
+
+	def __getattr__(self, key):
+		return self.get(key)
+	#end define
+#end class
+
+
+class TrackedDict(Dict):
+	'''
+	Dict of the local db. Nested dicts and lists are wrapped into
+	TrackedDict/TrackedList, each container knows its parent so that a change
+	anywhere in the tree can be reported to a DictTracker attached to the root.
+	Methods are underscore-prefixed so that they never shadow keys.
+	'''
+	__slots__ = ("_parent", "_key")
+	_tracker = None
+	_gen = 0
+	_epoch = 0
+
+	def __init__(self, *args, **kwargs):
+		object.__setattr__(self, "_parent", None)
+		object.__setattr__(self, "_key", None)
+		for item in args:
+			self._parse_dict(item)
+		if kwargs:
+			self._parse_dict(kwargs)
+	#end define
+
+	def _parse_dict(self, d):
+		setitem = dict.__setitem__
+		setattr = object.__setattr__
+		for key, value in d.items():
+			if type(value) in scalar_types:
+				setitem(self, key, value)
+				continue
+			if isinstance(value, dict):
+				child = dict.__new__(TrackedDict)
+				setattr(child, "_parent", self)
+				setattr(child, "_key", key)
+				child._parse_dict(value)
+				value = child
+			elif isinstance(value, list):
+				value = parse_list(value, parent=self, key=key)
+			setitem(self, key, value)
+	#end define
+
+	def _snapshot(self):
+		'''Return a detached copy of the tree'''
+		return TrackedDict(self)
+	#end define
+
+	def _adopt(self, key, value):
+		value = wrap_value(value)
+		if isinstance(value, (TrackedDict, TrackedList)):
+			if is_attached(value):
+				value = detach_value(value)
+			object.__setattr__(value, "_parent", self)
+			object.__setattr__(value, "_key", key)
+		return value
+	#end define
+
+	def _release(self, key):
+		value = dict.get(self, key)
+		if isinstance(value, (TrackedDict, TrackedList)) and value._parent is self and value._key == key:
+			object.__setattr__(value, "_parent", None)
+	#end define
+
+	def _track(self, tracker):
+		object.__setattr__(self, "_tracker", tracker)
+	#end define
+
+	def __setitem__(self, key, value):
+		if isinstance(value, (dict, list)) or isinstance(dict.get(self, key), (dict, list)):
+			self._release(key)
+			value = self._adopt(key, value)
+		if self._parent is not None or self._tracker is not None:
+			track_change(self, key)
+		dict.__setitem__(self, key, value)
+	#end define
+
+	def __delitem__(self, key):
+		self._release(key)
+		track_change(self, key)
+		dict.__delitem__(self, key)
+	#end define
+
+	def pop(self, key, *args):
+		if key in self:
+			self._release(key)
+			track_change(self, key)
+		return dict.pop(self, key, *args)
+	#end define
+
+	def popitem(self):
+		if len(self) == 0:
+			raise KeyError("popitem(): dictionary is empty")
+		key = next(reversed(self))
+		return key, self.pop(key)
+	#end define
+
+	def setdefault(self, key, default=None):
+		if key not in self:
+			self[key] = default
+		return self[key]
+	#end define
+
+	def update(self, *args, **kwargs):
+		for item in args + (kwargs,):
+			for key, value in dict(item).items():
+				self[key] = value
+	#end define
+
+	def clear(self):
+		for key in list(self):
+			self.pop(key)
+	#end define
+
+	def __setattr__(self, key, value):
+		self[key] = value
+	#end define
+#end class
+
+
+class TrackedList(list):
+	'''list stored inside a TrackedDict, reports its changes to the tree'''
+	__slots__ = ("_parent", "_key", "__dict__")
+	_gen = 0
+	_epoch = 0
+
+	def __init__(self, *args):
+		object.__setattr__(self, "_parent", None)
+		object.__setattr__(self, "_key", None)
+		list.__init__(self, *args)
+	#end define
+
+	def _adopt(self, value):
+		value = wrap_value(value)
+		if isinstance(value, (TrackedDict, TrackedList)):
+			if is_attached(value):
+				value = detach_value(value)
+			object.__setattr__(value, "_parent", self)
+		return value
+	#end define
+
+	def _changed(self):
+		track_change(self, None)
+	#end define
+
+	def __setitem__(self, index, value):
+		self._changed()
+		if isinstance(index, slice):
+			value = [self._adopt(item) for item in value]
+		else:
+			value = self._adopt(value)
+		list.__setitem__(self, index, value)
+	#end define
+
+	def __delitem__(self, index):
+		self._changed()
+		list.__delitem__(self, index)
+	#end define
+
+	def __iadd__(self, other):
+		self.extend(other)
+		return self
+	#end define
+
+	def __imul__(self, count):
+		self._changed()
+		return list.__imul__(self, count)
+	#end define
+
+	def append(self, value):
+		self._changed()
+		list.append(self, self._adopt(value))
+	#end define
+
+	def extend(self, values):
+		self._changed()
+		list.extend(self, [self._adopt(value) for value in values])
+	#end define
+
+	def insert(self, index, value):
+		self._changed()
+		list.insert(self, index, self._adopt(value))
+	#end define
+
+	def pop(self, *args):
+		self._changed()
+		return list.pop(self, *args)
+	#end define
+
+	def remove(self, value):
+		self._changed()
+		list.remove(self, value)
+	#end define
+
+	def clear(self):
+		self._changed()
+		list.clear(self)
+	#end define
+
+	def sort(self, *args, **kwargs):
+		self._changed()
+		list.sort(self, *args, **kwargs)
+	#end define
+
+	def reverse(self):
+		self._changed()
+		list.reverse(self)
+	#end define
+
+	def __reduce__(self):
+		return (self.__class__, (list(self),))
+	#end define
+#end class
+
+
+class LazyDict(TrackedDict):
+	'''
+	Dict that wraps nested plain dicts and lists only on the first access.
+	The plain values are owned by the LazyDict and never changed in place,
+	so snapshots can share them with the live tree.
+	'''
+	def __init__(self, *args, **kwargs):
+		object.__setattr__(self, "_parent", None)
+		object.__setattr__(self, "_key", None)
+		for item in args:
+			for key, value in item.items():
+				dict.__setitem__(self, key, self._own(key, value))
+		for key, value in kwargs.items():
+			dict.__setitem__(self, key, self._own(key, value))
+	#end define
+
+	def _own(self, key, value):
+		if isinstance(value, (Dict, TrackedList)):
+			value = freeze_data(value)
+		return value
+	#end define
+
+	def _wrap(self, key, value):
+		if type(value) is not dict and type(value) is not list:
+			return value
+		with lazy_wrap_lock:
+			value = dict.__getitem__(self, key)
+			if type(value) is dict:
+				value = LazyDict(value)
+			elif type(value) is list:
+				value = parse_list(value, lazy=True)
+			else:
+				return value
+			object.__setattr__(value, "_parent", self)
+			object.__setattr__(value, "_key", key)
+			dict.__setitem__(self, key, value)
+		return value
+	#end define
+
+	def _wrap_all(self):
+		for key, value in dict.items(self):
+			self._wrap(key, value)
+	#end define
+
+	def _freeze(self):
+		'''Return the tree as plain dicts and lists, sharing the unwrapped parts'''
+		return {key: freeze_data(value) for key, value in dict.items(self)}
+	#end define
+
+	def _snapshot(self):
+		return LazyDict(self._freeze())
+	#end define
+
+	def __getitem__(self, key):
+		return self._wrap(key, dict.__getitem__(self, key))
+	#end define
+
+	def get(self, key, default=None):
+		if key not in self:
+			return default
+		return self[key]
+	#end define
+
+	def pop(self, key, *args):
+		if key in self:
+			self[key]
+		return TrackedDict.pop(self, key, *args)
+	#end define
+
+	def items(self):
+		self._wrap_all()
+		return dict.items(self)
+	#end define
+
+	def values(self):
+		self._wrap_all()
+		return dict.values(self)
+	#end define
+#end class
+
+
+lazy_wrap_lock = threading.RLock()  # reentrant, see DictTracker.lock
+
+def parse_list(lst, lazy=False, parent=None, key=None):
+	setattr = object.__setattr__
+	result = list.__new__(TrackedList)
+	setattr(result, "_parent", parent)
+	setattr(result, "_key", key)
+	append = list.append
+	for value in lst:
+		if type(value) in scalar_types:
+			append(result, value)
+			continue
+		if lazy and type(value) is dict:
+			value = LazyDict(value)
+		elif isinstance(value, TrackedDict):
+			value = value._snapshot()
+		elif isinstance(value, dict):
+			value = TrackedDict(value)
+		elif isinstance(value, list):
+			value = parse_list(value, lazy, parent=result)
+		if isinstance(value, TrackedDict):
+			setattr(value, "_parent", result)
+		append(result, value)
+	return result
+#end define
+
+def wrap_value(value):
+	'''Wrap dicts and lists into TrackedDict/TrackedList'''
+	if isinstance(value, (TrackedDict, TrackedList)):
+		return value
+	if isinstance(value, dict):
+		return TrackedDict(value)
+	if isinstance(value, list):
+		return parse_list(value)
+	return value
+#end define
+
+def is_attached(value):
+	'''
+	True if the TrackedDict/TrackedList is still stored in its parent. A container belongs
+	to one tree only, storing it a second time stores a copy
+	'''
+	parent = value._parent
+	if parent is None:
+		return False
+	if isinstance(parent, dict):
+		return dict.get(parent, value._key) is value
+	return any(item is value for item in parent)
+#end define
+
+def detach_value(value):
+	'''Return a copy of a TrackedDict/TrackedList that does not belong to any tree'''
+	if isinstance(value, TrackedDict):
+		return value._snapshot()
+	if isinstance(value, TrackedList):
+		return parse_list(value)
+	return value
+#end define
+
+def freeze_data(value):
+	'''Convert Dict/List trees into plain dicts and lists'''
+	if isinstance(value, (LazyDict, DictSnapshot, ListSnapshot)):
+		return value._freeze()
+	if isinstance(value, dict) and type(value) is not dict:
+		return {key: freeze_data(item) for key, item in dict.items(value)}
+	if isinstance(value, list) and type(value) is not list:
+		return [freeze_data(item) for item in value]
+	return value
+#end define
+
+def track_change(node, key):
+	'''
+	Report a change of `key` in the container `node` to the tracker of the
+	root TrackedDict. Changes inside a list are reported as a change of the whole list.
+	Must be called before the container is changed.
+	'''
+	root = node
+	while root._parent is not None:
+		root = root._parent
+	tracker = root._tracker
+	if tracker is None:
+		return
+	nodes = [node]
+	path = [] if key is None else [key]
+	child = node
+	parent = node._parent
+	while parent is not None:
+		if type(parent) is TrackedList:
+			path = []
+		else:
+			path.append(child._key)
+		nodes.append(parent)
+		child = parent
+		parent = child._parent
+	generation = tracker.changed(tuple(reversed(path)), node)
+	for item in nodes:
+		object.__setattr__(item, "_gen", generation)
+#end define
+
+
+class DictTracker:
+	'''
+	Journal of the changed paths and mutation generation of a TrackedDict tree.
+	Also keeps the copy-on-write state of the last snapshot of the tree
+	'''
+	def __init__(self):
+		self.dirty = set()
+		self.generation = 0
+		self.snapshot_state = None
+		# Reentrant: exit() saves the db from a signal handler, which may interrupt a write
+		self.lock = threading.RLock()
+	#end define
+
+	def changed(self, path, node):
+		with self.lock:
+			self.generation += 1
+			self.dirty.add(path)
+			state = self.snapshot_state
+			if state is not None and node._epoch != state.epoch:
+				state.preserve(node)
+			return self.generation
+	#end define
+
+	def snapshot(self, root):
+		'''Return a read-only view of `root` as it is now, in O(1)'''
+		with self.lock:
+			epoch = self.snapshot_state.epoch + 1 if self.snapshot_state else 1
+			self.snapshot_state = SnapshotState(epoch, self.generation)
+			return DictSnapshot(root, self.snapshot_state)
+	#end define
+
+	def take(self):
+		'''Return the changed paths without the ones covered by a changed parent'''
+		with self.lock:
+			dirty, self.dirty = self.dirty, set()
+		result = list()
+		for path in sorted(dirty, key=len):
+			if not any(path[:i] in dirty for i in range(len(path))):
+				result.append(path)
+		return result
+	#end define
+
+	def clear(self):
+		with self.lock:
+			self.dirty = set()
+	#end define
+#end class
+
+
+class SnapshotState:
+	'''Contents of the containers changed after a snapshot was taken'''
+	def __init__(self, epoch, generation):
+		self.epoch = epoch
+		self.generation = generation
+		self.preserved = dict()
+	#end define
+
+	def preserve(self, node):
+		if isinstance(node, dict):
+			content = dict.copy(node)
+		else:
+			content = list(node)
+		self.preserved[id(node)] = (node, content)
+		object.__setattr__(node, "_epoch", self.epoch)
+	#end define
+
+	def content(self, node):
+		item = self.preserved.get(id(node))
+		if item is None:
+			return node
+		return item[1]
+	#end define
+
+	def view(self, value):
+		if isinstance(value, TrackedDict):
+			return DictSnapshot(value, self)
+		if isinstance(value, TrackedList):
+			return ListSnapshot(value, self)
+		return value
+	#end define
+#end class
+
+
+class DictSnapshot:
+	'''
+	Read-only view of a TrackedDict at the time of the snapshot. Subtrees that
+	were not changed since then are shared with the live tree.
+	'''
+	__slots__ = ("_node", "_state")
+
+	def __init__(self, node, state):
+		self._node = node
+		self._state = state
+	#end define
+
+	def _unchanged(self):
+		return self._node._gen <= self._state.generation
+	#end define
+
+	def _freeze(self):
+		return {key: freeze_data(value) for key, value in self.items()}
+	#end define
+
+	def get(self, key, default=None):
+		content = self._state.content(self._node)
+		if key not in content:
+			return default
+		return self._state.view(dict.get(content, key))
+	#end define
+
+	def __getitem__(self, key):
+		content = self._state.content(self._node)
+		return self._state.view(dict.__getitem__(content, key))
+	#end define
+
+	def __getattr__(self, key):
+		return self.get(key)
+	#end define
+
+	def __contains__(self, key):
+		return key in self._state.content(self._node)
+	#end define
+
+	def __iter__(self):
+		return iter(list(dict.keys(self._state.content(self._node))))
+	#end define
+
+	def __len__(self):
+		return len(self._state.content(self._node))
+	#end define
+
+	def keys(self):
+		return list(self)
+	#end define
+
+	def items(self):
+		return [(key, self[key]) for key in self]
+	#end define
+
+	def values(self):
+		return [self[key] for key in self]
+	#end define
+
+	def __eq__(self, other):
+		if other is self._node and self._unchanged():
+			return True
+		if isinstance(other, DictSnapshot) and other._node is self._node and other._state is self._state:
+			return True
+		if not isinstance(other, (dict, DictSnapshot)) or len(other) != len(self):
+			return False
+		missing = object()
+		for key in self:
+			if self[key] != other.get(key, missing):
+				return False
+		return True
+	#end define
+
+	__hash__ = None
+
+	def __repr__(self):
+		return repr(self._freeze())
+	#end define
+#end class
+
+
+class ListSnapshot:
+	'''Read-only view of a TrackedList at the time of the snapshot'''
+	__slots__ = ("_node", "_state")
+
+	def __init__(self, node, state):
+		self._node = node
+		self._state = state
+	#end define
+
+	def _freeze(self):
+		return [freeze_data(value) for value in self]
+	#end define
+
+	def __getitem__(self, index):
+		return self._state.view(self._state.content(self._node)[index])
+	#end define
+
+	def __iter__(self):
+		return iter([self._state.view(value) for value in self._state.content(self._node)])
+	#end define
+
+	def __len__(self):
+		return len(self._state.content(self._node))
+	#end define
+
+	def __eq__(self, other):
+		if other is self._node and self._node._gen <= self._state.generation:
+			return True
+		if not isinstance(other, (list, ListSnapshot)) or len(other) != len(self):
+			return False
+		return all(a == b for a, b in zip(self, other))
+	#end define
+
+	__hash__ = None
+
+	def __repr__(self):
+		return repr(self._freeze())
+	#end define
+#end class
+
+
+class bcolors:
+	'''This class is designed to display text in color format'''
+	red = "\033[31m"
+	green = "\033[32m"
+	yellow = "\033[33m"
+	blue = "\033[34m"
+	magenta = "\033[35m"
+	cyan = "\033[36m"
+	endc = "\033[0m"
+	bold = "\033[1m"
+	underline = "\033[4m"
+	default = "\033[39m"
+
+	DEBUG = magenta
+	INFO = blue
+	OKGREEN = green
+	WARNING = yellow
+	ERROR = red
+	ENDC = endc
+	BOLD = bold
+	UNDERLINE = underline
+
+	def get_args(*args):
+		text = ""
+		for item in args:
+			if item is None:
+				continue
+			text += str(item)
+		return text
+	#end define
+
+	def magenta_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.magenta + text + bcolors.endc
+		return text
+	#end define
+
+	def blue_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.blue + text + bcolors.endc
+		return text
+	#end define
+
+	def green_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.green + text + bcolors.endc
+		return text
+	#end define
+
+	def yellow_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.yellow + text + bcolors.endc
+		return text
+	#end define
+
+	def red_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.red + text + bcolors.endc
+		return text
+	#end define
+
+	def bold_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.bold + text + bcolors.endc
+		return text
+	#end define
+
+	def underline_text(*args):
+		text = bcolors.get_args(*args)
+		text = bcolors.underline + text + bcolors.endc
+		return text
+	#end define
+
+	colors = {"red": red, "green": green, "yellow": yellow, "blue": blue, "magenta": magenta, "cyan": cyan,
+			  "endc": endc, "bold": bold, "underline": underline}
+#end class
+
+
+class LogSink:
+	'''Background writer for MyPyClass log records.
+
+	Producers only append a record to a bounded deque (atomic under the GIL,
+	no lock taken); a dedicated thread formats the records and commits them
+	to the console and the log file in groups.
+	'''
+	def __init__(self, local):
+		self.local = local
+		self.queue = collections.deque()
+		self.max_size = 65536
+		self.flush_interval = 1
+		self.flush_bytes = 65536
+		self.overflow = "drop"
+		self.pending_bytes = 0
+		self.dropped = 0
+		self.written = 0
+		self.working = True
+		self.wakeup = threading.Event()
+		self.not_full = threading.Event()
+		self.lock = threading.RLock()  # exit() flushes from a signal handler
+		self.thread = None
+	#end define
+
+	def start(self):
+		if self.thread is not None:
+			return
+		self.thread = threading.Thread(target=self.run, name="log_sink", daemon=True)
+		self.thread.start()
+	#end define
+
+	def configure(self, config):
+		self.max_size = config.logQueueSize or self.max_size
+		self.flush_interval = config.logFlushInterval or self.flush_interval
+		self.flush_bytes = config.logFlushBytes or self.flush_bytes
+		self.overflow = config.logQueueOverflow or self.overflow
+	#end define
+
+	def put(self, record, urgent=False):
+		if len(self.queue) >= self.max_size and not self.wait_space():
+			self.dropped += 1
+			return
+		self.queue.append(record)
+		self.pending_bytes += len(record[3])
+		if urgent or self.pending_bytes >= self.flush_bytes:
+			self.wakeup.set()
+	#end define
+
+	def wait_space(self):
+		if self.overflow != "block" or threading.current_thread() is self.thread:
+			return False
+		while self.working and len(self.queue) >= self.max_size:
+			self.not_full.clear()
+			self.wakeup.set()
+			self.not_full.wait(0.1)
+		return len(self.queue) < self.max_size
+	#end define
+
+	def run(self):
+		while self.working:
+			self.wakeup.wait(self.flush_interval)
+			self.wakeup.clear()
+			try:
+				self.flush()
+			except Exception as err:
+				sys.stderr.write(f"log_sink error: {err}\n")
+	#end define
+
+	def stop(self):
+		self.working = False
+		self.wakeup.set()
+		self.not_full.set()
+		self.flush()
+	#end define
+
+	def flush(self):
+		with self.lock:
+			self.pending_bytes = 0
+			records = list()
+			while self.queue:
+				records.append(self.queue.popleft())
+			self.not_full.set()
+			self.local.buffer.log_dropped = self.dropped
+			self.local.apply_log_config()
+			if len(records) == 0:
+				return
+			lines = [self.format_record(record) for record in records]
+			text = '\n'.join(lines) + '\n'
+			sys.stdout.write(text)
+			sys.stdout.flush()
+			config = self.local.db.config
+			if config.isWritingLogFile is not False:
+				if config.logFormat == "json":
+					text = '\n'.join(self.format_record_json(record) for record in records) + '\n'
+				self.local.write_log_text(text)
+			self.written += len(records)
+	#end define
+
+	def format_record(self, record):
+		created, mode, thread_name, input_text, extra = record
+		time_text = date_time_library.datetime.fromtimestamp(created / 10**9, date_time_library.timezone.utc)
+		time_text = time_text.strftime("%d.%m.%Y, %H:%M:%S.%f")[:-3]
+		time_text = "{0} (UTC)".format(time_text).ljust(32, ' ')
+
+		# Set color mode
+		if mode == INFO:
+			color_start = bcolors.INFO + bcolors.BOLD
+		elif mode == WARNING:
+			color_start = bcolors.WARNING + bcolors.BOLD
+		elif mode == ERROR:
+			color_start = bcolors.ERROR + bcolors.BOLD
+		elif mode == DEBUG:
+			color_start = bcolors.DEBUG + bcolors.BOLD
+		else:
+			color_start = bcolors.UNDERLINE + bcolors.BOLD
+		mode_text = "{0}{1}{2}".format(color_start, "[{0}]".format(mode).ljust(10, ' '), bcolors.ENDC)
+
+		# Set color thread
+		if mode == ERROR:
+			color_start = bcolors.ERROR + bcolors.BOLD
+		else:
+			color_start = bcolors.OKGREEN + bcolors.BOLD
+		thread_text = "{0}{1}{2}".format(color_start, "<{0}>".format(thread_name).ljust(14, ' '), bcolors.ENDC)
+		return mode_text + time_text + thread_text + input_text
+	#end define
+
+	def format_record_json(self, record):
+		created, mode, thread_name, input_text, extra = record
+		if '\033' in input_text:
+			input_text = ansi_escape_pattern.sub('', input_text)
+		item = {"ts": created, "level": mode, "thread": thread_name, "msg": input_text}
+		if extra:
+			for key, value in extra.items():
+				item.setdefault(key, value)
+		return json.dumps(item, ensure_ascii=False, default=str)
+	#end define
+#end class
+
+
+class LogRotator:
+	'''Size and time based rotation of the MyPyClass log file.
+
+	The size of the current segment is taken from fstat and the line count is
+	kept incrementally, so the file is never rescanned. Rotated segments are
+	renamed to `.log.1`, `.log.2.gz`, ... and compressed on a background thread.
+	'''
+	def __init__(self, local):
+		self.local = local
+		self.path = None
+		self.size = 0
+		self.lines = 0
+		self.opened = None
+		self.lock = threading.RLock()  # exit() may rotate from a signal handler
+		self.compress_queue = collections.deque()
+		self.compress_thread = None
+	#end define
+
+	def write(self, path, text):
+		data = text.encode("utf-8")
+		with open(path, 'ab') as file:
+			if self.path != path or file.tell() < self.size:
+				self.reset(path, file.tell())
+			file.write(data)
+			self.size = file.tell()
+		self.lines += text.count('\n')
+
+		config = self.local.db.config
+		if config.isLimitLogFile is not False and self.need_rotate(config):
+			self.rotate(config)
+	#end define
+
+	def reset(self, path, size):
+		self.path = path
+		self.size = size
+		self.opened = self.get_segment_time(path) if size > 0 else time.time()
+		self.lines = self.local.count_lines(path) if size > 0 else 0
+	#end define
+
+	def get_segment_time(self, path):
+		'''Creation time of an existing segment: birth time, time of the first line or mtime'''
+		stat = os.stat(path)
+		result = getattr(stat, "st_birthtime", None)
+		if result is None:
+			with open(path, 'rb') as file:
+				result = get_log_line_time(file.readline(4096))
+		if result is None:
+			result = stat.st_mtime
+		return result
+	#end define
+
+	def need_rotate(self, config):
+		if config.logFileSizeLines and self.lines > config.logFileSizeLines:
+			return True
+		if config.logFileMaxSize and self.size > config.logFileMaxSize:
+			return True
+		if config.logRotateInterval and time.time() - self.opened > config.logRotateInterval:
+			return True
+		return False
+	#end define
+
+	def segment_path(self, index):
+		path = f"{self.path}.{index}"
+		if os.path.isfile(path + ".gz"):
+			return path + ".gz"
+		return path
+	#end define
+
+	def rotate(self, config):
+		count = config.logRotateCount or 1
+		with self.lock:
+			for index in range(count, 0, -1):
+				src = self.segment_path(index)
+				if not os.path.isfile(src):
+					continue
+				if index == count:
+					os.remove(src)
+					continue
+				dst = f"{self.path}.{index + 1}" + (".gz" if src.endswith(".gz") else "")
+				os.replace(src, dst)
+				if config.isCompressLogFile is not False and not dst.endswith(".gz"):
+					self.compress_queue.append(dst)
+			os.replace(self.path, f"{self.path}.1")
+			self.reset(self.path, 0)
+		#end with
+		self.start_compress()
+		self.apply_retention(config)
+	#end define
+
+	def start_compress(self):
+		with self.lock:
+			if len(self.compress_queue) == 0 or self.compress_thread is not None:
+				return
+			self.compress_thread = threading.Thread(target=self.compress_process, name="log_compress", daemon=True)
+			self.compress_thread.start()
+	#end define
+
+	def compress_process(self):
+		while True:
+			with self.lock:
+				# Checked under the lock, a path queued by rotate() is never left behind
+				if len(self.compress_queue) == 0:
+					self.compress_thread = None
+					return
+				path = self.compress_queue.popleft()
+				if not os.path.isfile(path):
+					continue
+				try:
+					self.compress_file(path)
+				except Exception as err:
+					self.local.add_log(f"compress_process error: {err}", ERROR)
+	#end define
+
+	def compress_file(self, path):
+		tmp = path + ".gz.tmp"
+		with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+			shutil.copyfileobj(src, dst, 1 << 20)
+		os.replace(tmp, path + ".gz")
+		os.remove(path)
+	#end define
+
+	def get_segments(self):
+		segments = list()
+		index = 1
+		while True:
+			path = self.segment_path(index)
+			if not os.path.isfile(path):
+				break
+			segments.append(path)
+			index += 1
+		return segments
+	#end define
+
+	def apply_retention(self, config):
+		max_bytes = config.logRotateMaxBytes
+		max_age = config.logRotateMaxAge
+		if not max_bytes and not max_age:
+			return
+		with self.lock:
+			total = 0
+			time_now = time.time()
+			for path in self.get_segments():
+				stat = os.stat(path)
+				total += stat.st_size
+				if max_bytes and total > max_bytes:
+					os.remove(path)
+				elif max_age and time_now - stat.st_mtime > max_age:
+					os.remove(path)
+	#end define
+#end class
+
+
+class LogFile:
+	'''
+	Read access to a MyPyClass log file without loading it: line count and tail
+	through mmap, follow() like `tail -f`, and time range queries over a sparse
+	index of (time, offset) pairs taken every `index_step` bytes.
+	Works with the text and the json log format
+	'''
+	def __init__(self, path, index_step=1 << 20):
+		self.path = path
+		self.index_step = index_step
+		self.index = list()  # [(time, offset)]
+		self.index_stamp = None  # (inode, next offset to index)
+	#end define
+
+	def open(self):
+		'''The log file, None right after a rotation until the next flush creates it'''
+		try:
+			return open(self.path, 'rb')
+		except FileNotFoundError:
+			return None
+	#end define
+
+	def count_lines(self):
+		return count_file_lines(self.path)
+	#end define
+
+	def tail(self, count=10):
+		'''Last `count` lines, read backwards from the end of the file'''
+		file = self.open()
+		if file is None:
+			return list()
+		with file:
+			buf = map_file(file)
+			if buf is None:
+				return list()
+			with buf:
+				end = len(buf)
+				if buf[end - 1] == 10:  # b'\n'
+					end -= 1
+				begin = pos = end
+				for i in range(count):
+					newline = buf.rfind(b'\n', 0, pos)
+					begin = newline + 1
+					if newline < 0:
+						break
+					pos = newline
+				if begin >= end:
+					return list()
+				return buf[begin:end].decode("utf-8", "replace").split('\n')
+	#end define
+
+	def follow(self, interval=0.5, stop_event=None, from_end=True):
+		'''Yield the lines appended to the log, the file is reopened after rotation'''
+		file = None
+		inode = None
+		pending = b""
+		try:
+			while stop_event is None or not stop_event.is_set():
+				if file is None:
+					try:
+						file = open(self.path, 'rb')
+					except FileNotFoundError:
+						thr_wait(stop_event, interval)
+						continue
+					inode = os.fstat(file.fileno()).st_ino
+					if from_end:
+						file.seek(0, os.SEEK_END)
+					from_end = False
+				data = file.read()
+				if data:
+					lines = (pending + data).split(b'\n')
+					pending = lines.pop()
+					for line in lines:
+						yield line.decode("utf-8", "replace")
+					continue
+				try:
+					stat = os.stat(self.path)
+				except FileNotFoundError:
+					stat = None
+				if stat is None or stat.st_ino != inode or stat.st_size < file.tell():
+					# Rotated or truncated
+					file.close()
+					file = None
+					pending = b""
+					continue
+				thr_wait(stop_event, interval)
+		finally:
+			if file is not None:
+				file.close()
+	#end define
+
+	def update_index(self):
+		'''Extend the sparse index over the lines appended since the last call'''
+		file = self.open()
+		if file is None:
+			self.index = list()
+			self.index_stamp = None
+			return
+		with file:
+			inode = os.fstat(file.fileno()).st_ino
+			buf = map_file(file)
+			size = len(buf) if buf is not None else 0
+			if self.index_stamp is None or self.index_stamp[0] != inode or self.index_stamp[1] > size:
+				self.index = list()
+				self.index_stamp = (inode, 0)
+			if buf is None:
+				return
+			with buf:
+				offset = self.index_stamp[1]
+				while offset < size:
+					time, line_offset = find_log_line_time(buf, offset)
+					if time is None:
+						break
+					self.index.append((time, line_offset))
+					offset = line_offset + self.index_step
+				self.index_stamp = (inode, offset)
+	#end define
+
+	def query(self, start=None, end=None):
+		'''Yield the lines logged in [start, end), times as timestamps or datetime'''
+		if isinstance(start, date_time_library.datetime):
+			start = start.timestamp()
+		if isinstance(end, date_time_library.datetime):
+			end = end.timestamp()
+		self.update_index()
+		offset = 0
+		if start is not None:
+			position = bisect.bisect_left([item[0] for item in self.index], start) - 1
+			if position >= 0:
+				offset = self.index[position][1]
+		file = self.open()
+		if file is None:
+			return
+		with file:
+			buf = map_file(file)
+			if buf is None:
+				return
+			with buf:
+				include = False
+				while True:
+					newline = buf.find(b'\n', offset)
+					if newline < 0:
+						break
+					time = get_log_line_time(buf[offset:min(newline, offset + 128)])
+					if time is not None:
+						if end is not None and time >= end:
+							break
+						include = start is None or time >= start
+					# Lines without time continue a multiline record
+					if include:
+						yield buf[offset:newline].decode("utf-8", "replace")
+					offset = newline + 1
+	#end define
+#end class
+
+
+class CycleStats:
+	'''
+	Runtime counters of a cycle or thread: calls, errors, durations and a
+	log-linear (HDR-style) histogram of durations in ns with 4 sub-buckets
+	per power of two, so any percentile is known within 25%.
+	Updates take no lock to stay cheap, overlapping runs of the same job may
+	rarely lose an update
+	'''
+	__slots__ = ("name", "count", "errors", "last", "min", "max", "total",
+		"missed", "overruns", "histogram")
+
+	def __init__(self, name):
+		self.name = name
+		self.count = 0
+		self.errors = 0
+		self.last = 0
+		self.min = 0
+		self.max = 0
+		self.total = 0
+		self.missed = 0
+		self.overruns = 0
+		self.histogram = [0] * 256
+	#end define
+
+	def record(self, duration, error=False):
+		n = duration.bit_length()
+		index = duration if n < 3 else ((n - 3) << 2) + (duration >> (n - 3))
+		if duration > self.max:
+			self.max = duration
+		if duration < self.min or self.count == 0:
+			self.min = duration
+		self.count += 1
+		self.errors += error
+		self.last = duration
+		self.total += duration
+		self.histogram[index] += 1
+	#end define
+
+	def percentile(self, percent):
+		'''Upper bound of the bucket holding the percentile, in ns'''
+		rank = self.count * percent / 100
+		seen = 0
+		for index, count in enumerate(self.histogram):
+			seen += count
+			if count and seen >= rank:
+				return min(get_histogram_bucket_max(index), self.max)
+		return 0
+	#end define
+
+	def get_data(self):
+		'''Plain data for buffer, durations in ms'''
+		data = Dict()
+		data.count = self.count
+		data.errors = self.errors
+		data.missed = self.missed
+		data.overruns = self.overruns
+		data.last = self.last / 1e6
+		data.min = self.min / 1e6
+		data.max = self.max / 1e6
+		data.avg = self.total / self.count / 1e6 if self.count else 0
+		data.p50 = self.percentile(50) / 1e6
+		data.p99 = self.percentile(99) / 1e6
+		data.histogram = [[get_histogram_bucket_max(index) / 1e6, count]
+			for index, count in enumerate(self.histogram) if count]
+		return data
+	#end define
+#end class
+
+
+class CycleJob:
+	'''Periodic job of the Scheduler, runs once if `sec` is None'''
+	def __init__(self, func, name, args, sec, mode, jitter, max_concurrency, stats=None, reserved=False):
+		self.func = func
+		self.name = name
+		self.args = args
+		self.sec = sec
+		self.mode = mode  # delay || rate
+		self.jitter = jitter
+		self.max_concurrency = max_concurrency
+		self.running = 0
+		self.stats = stats or CycleStats(name)
+		self.reserved = reserved  # may use the workers kept for the built-in cycles
+		self.cancelled = False
+	#end define
+
+	@property
+	def overruns(self):
+		return self.stats.overruns
+	#end define
+
+	@property
+	def missed(self):
+		return self.stats.missed
+	#end define
+
+	def cancel(self):
+		self.cancelled = True
+	#end define
+#end class
+
+
+class PoolTask:
+	'''Task of the managed pools, its timeout counts from the start of the task'''
+	def __init__(self, name, timeout, process):
+		self.name = name
+		self.timeout = timeout
+		self.process = process
+		self.future = None
+		self.start_time = None
+		self.started = threading.Event()
+		self.timer_job = None  # timeout, or the start poll of a process task
+	#end define
+#end class
+
+
+class Scheduler:
+	'''
+	Runs the periodic jobs of MyPyClass. Deadlines are kept in a heap, a single
+	timer thread hands due jobs to a small pool of worker threads. A few
+	workers above max_workers are kept for reserved jobs (save_db, self_test)
+	so that busy user cycles can not delay them.
+	Jobs run with fixed delay (the period starts after the job ends) or at a
+	fixed rate (the period starts at the previous deadline).
+	'''
+	def __init__(self, local, stop_event):
+		self.local = local
+		self.stop_event = stop_event
+		self.max_workers = 8
+		self.reserved_workers = 2
+		self.heap = list()
+		self.counter = 0
+		self.cancelled = 0
+		self.cond = threading.Condition()
+		self.tasks = queue.SimpleQueue()  # (job, queued time)
+		self.workers = list()
+		self.idle = 0
+		self.max_wait = 0.5  # sec in the queue that counts as a backlog
+		self.warning_interval = 60
+		self.warning_time = None
+		self.thread = None
+	#end define
+
+	def add_job(self, job, delay=0):
+		with self.cond:
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+				self.thread.start()
+			self.push(job, time.monotonic() + delay)
+		return job
+	#end define
+
+	def push(self, job, deadline):
+		if job.jitter:
+			deadline += random.uniform(0, job.jitter)
+		self.counter += 1
+		heapq.heappush(self.heap, (deadline, self.counter, job))
+		self.cond.notify()
+	#end define
+
+	def cancel(self, job):
+		'''Cancel a job, the heap is compacted when most of it is cancelled jobs'''
+		with self.cond:
+			job.cancel()
+			self.cancelled += 1
+			if self.cancelled > 64 and self.cancelled > len(self.heap) // 2:
+				self.heap = [item for item in self.heap if not item[2].cancelled]
+				heapq.heapify(self.heap)
+				self.cancelled = 0
+	#end define
+
+	def stop(self):
+		with self.cond:
+			self.stop_event.set()
+			self.cond.notify_all()
+		for worker in self.workers:
+			self.tasks.put(None)
+	#end define
+
+	def run(self):
+		while not self.stop_event.is_set():
+			# The condition is released between the jobs, so that finished workers are counted
+			with self.cond:
+				if len(self.heap) == 0:
+					self.cond.wait()
+					continue
+				deadline, counter, job = self.heap[0]
+				delay = deadline - time.monotonic()
+				if delay > 0:
+					self.cond.wait(delay)
+					continue
+				heapq.heappop(self.heap)
+				if not job.cancelled:
+					self.dispatch(job, deadline)
+	#end define
+
+	def call_later(self, delay, func, args=None, name=None):
+		job = CycleJob(func, name or func.__name__, args, None, "delay", 0, 1)
+		return self.add_job(job, delay)
+	#end define
+
+	def dispatch(self, job, deadline):
+		if job.mode == "rate" and job.sec is not None:
+			next_deadline = deadline + job.sec
+			time_now = time.monotonic()
+			while next_deadline <= time_now:
+				next_deadline += job.sec
+				job.stats.missed += 1
+			self.push(job, next_deadline)
+		if job.running >= job.max_concurrency:
+			job.stats.missed += 1
+			return
+		job.running += 1
+		max_workers = self.max_workers + (self.reserved_workers if job.reserved else 0)
+		if self.idle <= 0 and len(self.workers) < max_workers:
+			# A new worker starts with its job, so that it does not take a queued one
+			worker = threading.Thread(target=self.worker, args=(job,), name="scheduler_worker", daemon=True)
+			self.workers.append(worker)
+			worker.start()
+			return
+		# Taken by an idle worker or by the next one to finish, below zero `idle` is the backlog
+		self.idle -= 1
+		self.tasks.put((job, time.monotonic()))
+	#end define
+
+	def worker(self, job):
+		while job is not None:
+			self.run_job(job)
+			item = self.tasks.get()
+			if item is None:
+				break
+			job, queued_time = item
+			self.check_wait(job, time.monotonic() - queued_time)
+	#end define
+
+	def check_wait(self, job, wait):
+		'''Warn, at most once per warning_interval, when jobs wait for a free worker'''
+		if wait < self.max_wait:
+			return
+		time_now = time.monotonic()
+		with self.cond:
+			if self.warning_time is not None and time_now - self.warning_time < self.warning_interval:
+				return
+			self.warning_time = time_now
+		self.local.add_log("Scheduler: all %s workers are busy, cycle %s waited %.3f sec", WARNING, len(self.workers), job.name, wait)
+	#end define
+
+	def run_job(self, job):
+		thread = threading.current_thread()
+		thread.name = job.name
+		self.local.try_function(job.func, args=job.args, stats=job.stats)
+		duration = job.stats.last / 1e9
+		thread.name = "scheduler_worker"
+		with self.cond:
+			self.idle += 1
+			job.running -= 1
+			if job.sec is None:
+				return
+			if duration > job.sec:
+				job.stats.overruns += 1
+				self.local.add_log("Cycle %s overrun: %.3f sec > %s sec", DEBUG, job.name, duration, job.sec)
+			if job.mode != "rate" and not job.cancelled and not self.stop_event.is_set():
+				self.push(job, time.monotonic() + job.sec)
+	#end define
+#end class
+
+
+class ResourceSampler:
+	'''
+	Samples process and host resources for self_test. Keeps one psutil.Process,
+	reads the process counters in one oneshot() pass and keeps the samples in a
+	ring buffer. The sampling interval doubles (up to max_interval) while memory
+	and CPU stay flat and drops back to min_interval when they move
+	'''
+	def __init__(self, history_size=600):
+		self.process = None
+		self.history = collections.deque(maxlen=history_size)
+		self.min_interval = 1
+		self.max_interval = 10
+		self.interval = 1
+		self.next_time = 0
+		self.last = None
+	#end define
+
+	def configure(self, config):
+		self.min_interval = config.resourceSampleMinInterval or self.min_interval
+		self.max_interval = config.resourceSampleMaxInterval or self.max_interval
+		history_size = config.resourceHistorySize or self.history.maxlen
+		if history_size != self.history.maxlen:
+			self.history = collections.deque(self.history, maxlen=history_size)
+	#end define
+
+	def sample_if_due(self):
+		time_now = time.monotonic()
+		if time_now < self.next_time:
+			return None
+		sample = self.sample()
+		self.adapt(sample)
+		self.next_time = time_now + self.interval
+		return sample
+	#end define
+
+	def sample(self):
+		if self.process is None:
+			self.process = psutil.Process()
+		process = self.process
+		sample = Dict()
+		sample.time = time.time()
+		with process.oneshot():
+			sample.rss = process.memory_info().rss
+			sample.cpu_percent = process.cpu_percent()
+			sample.threads = process.num_threads()
+			sample.fds = try_call(process, "num_fds")
+			ctx_switches = process.num_ctx_switches()
+			io_counters = try_call(process, "io_counters")
+		sample.ctx_switches_voluntary = ctx_switches.voluntary
+		sample.ctx_switches_involuntary = ctx_switches.involuntary
+		sample.io_read_bytes = io_counters.read_bytes if io_counters else None
+		sample.io_write_bytes = io_counters.write_bytes if io_counters else None
+		sample.available_memory = psutil.virtual_memory().available
+		self.history.append(sample)
+		return sample
+	#end define
+
+	def adapt(self, sample):
+		last = self.last
+		self.last = sample
+		if last is None:
+			return
+		rss_delta = abs(sample.rss - last.rss) / max(last.rss, 1)
+		cpu_delta = abs(sample.cpu_percent - last.cpu_percent)
+		if rss_delta < 0.01 and cpu_delta < 5:
+			self.interval = min(self.interval * 2, self.max_interval)
+		else:
+			self.interval = self.min_interval
+	#end define
+
+	def get_history(self, field=None, since=None):
+		'''Samples (or `(time, value)` pairs of one field) newer than `since` timestamp'''
+		samples = [sample for sample in list(self.history) if since is None or sample.time >= since]
+		if field is None:
+			return samples
+		return [(sample.time, sample[field]) for sample in samples]
+	#end define
+#end class
+
+
+class StackSampler:
+	'''
+	Statistical profiler: samples the stacks of all threads with
+	sys._current_frames() and writes them in collapsed format
+	("thread;outer;inner count" lines, as read by flamegraph.pl and speedscope).
+	Costs nothing while idle
+	'''
+	def __init__(self, local):
+		self.local = local
+		self.thread = None
+	#end define
 
-class Dict(dict):
-	def __init__(self, *args, **kwargs):
-		for item in args:
-			self._parse_dict(item)
-		self._parse_dict(kwargs)
+	def start(self, duration, interval):
+		if self.thread is not None and self.thread.is_alive():
+			return False
+		self.thread = threading.Thread(target=self.run, name="profiler", args=(duration, interval), daemon=True)
+		self.thread.start()
+		return True
 	#end define
 
-	def _parse_dict(self, d):
-		for key, value in d.items():
-			if type(value) in [dict, Dict]:
-				value = Dict(value)
-			if type(value) == list:
-				value = self._parse_list(value)
-			self[key] = value
+	def run(self, duration, interval):
+		stacks = self.sample(duration, interval)
+		file_name = "{name}_{time}.collapsed".format(name=self.local.buffer.my_name, time=time.strftime("%Y%m%d_%H%M%S"))
+		path = self.local.buffer.my_temp_dir + file_name
+		text = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+		self.local.write_file(path, text)
+		self.local.add_log(f"Profile written to {path}: {sum(stacks.values())} samples", INFO)
 	#end define
 
-	def _parse_list(self, lst):
-		result = list()
-		for value in lst:
-			if type(value) in [dict, Dict]:
-				value = Dict(value)
-			result.append(value)
-		return result
+	def sample(self, duration, interval):
+		stacks = collections.Counter()
+		names = dict()
+		my_ident = threading.get_ident()
+		end_time = time.monotonic() + duration
+		while time.monotonic() < end_time:
+			for ident, frame in sys._current_frames().items():
+				if ident == my_ident:
+					continue
+				name = names.get(ident)
+				if name is None:
+					names.update((thread.ident, thread.name) for thread in threading.enumerate())
+					name = names.get(ident, str(ident))
+				stack = list()
+				while frame is not None:
+					code = frame.f_code
+					stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+					frame = frame.f_back
+				stack.append(name)
+				stacks[';'.join(reversed(stack))] += 1
+			del frame
+			time.sleep(interval)
+		return stacks
 	#end define
+#end class
 
-	def __setattr__(self, key, value):
-		self[key] = value
+
+@functools.lru_cache(maxsize=None)
+def get_metrics_handler():
+	'''Request handler of MetricsExporter, built on first use to import http.server lazily'''
+	class MetricsHandler(http_server.BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path.split('?')[0] not in ("/", "/metrics"):
+				self.send_error(404)
+				return
+			body = self.server.exporter.render().encode("utf-8")
+			self.send_response(200)
+			self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		#end define
+
+		def log_message(self, format, *args):
+			self.server.exporter.local.add_log("Metrics request: " + format, DEBUG, *args)
+		#end define
+	#end class
+	return MetricsHandler
+#end define
+
+
+class MetricsExporter:
+	'''
+	Exports the self_test gauges, cycle stats, log queue and db save counters
+	in OpenMetrics text format. The text is rendered on every scrape, served
+	by an HTTP server on its own thread or written into a textfile
+	'''
+	def __init__(self, local):
+		self.local = local
+		self.server = None
+		self.thread = None
 	#end define
 
-	def __getattr__(self, key):
-		return self.get(key)
+	def start(self, host, port):
+		self.server = http_server.HTTPServer((host, port), get_metrics_handler())
+		self.server.exporter = self
+		self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+		self.thread.start()
+		return self.server.server_address[1]
+	#end define
+
+	def stop(self):
+		if self.server is None:
+			return
+		self.server.shutdown()
+		self.server.server_close()
+		self.server = None
+	#end define
+
+	def write_textfile(self, path):
+		self.local.write_file(path, self.render())
+	#end define
+
+	def render(self):
+		local = self.local
+		buffer = local.buffer
+		lines = list()
+		add_metric(lines, "memory_using_megabytes", "gauge", "Resident memory of the process", [("", None, buffer.memory_using)])
+		add_metric(lines, "free_space_memory_megabytes", "gauge", "Available memory of the host", [("", None, buffer.free_space_memory)])
+		add_metric(lines, "threads", "gauge", "Number of threads", [("", None, buffer.thread_count)])
+		add_metric(lines, "cpu_percent", "gauge", "CPU usage of the process", [("", None, buffer.cpu_percent)])
+		add_metric(lines, "open_fds", "gauge", "Open file descriptors", [("", None, buffer.fd_count)])
+		add_metric(lines, "context_switches", "counter", "Context switches of the process", [
+			("_total", {"kind": "voluntary"}, buffer.ctx_switches_voluntary),
+			("_total", {"kind": "involuntary"}, buffer.ctx_switches_involuntary)])
+		add_metric(lines, "io_bytes", "counter", "Bytes read and written by the process", [
+			("_total", {"direction": "read"}, buffer.io_read_bytes),
+			("_total", {"direction": "write"}, buffer.io_write_bytes)])
+		add_metric(lines, "log_queue_length", "gauge", "Log records waiting to be written", [("", None, len(local._log_sink.queue))])
+		add_metric(lines, "log_dropped", "counter", "Log records dropped on queue overflow", [("_total", None, buffer.log_dropped)])
+		add_metric(lines, "db_saves", "counter", "Local db save attempts", [
+			("_total", {"result": "performed"}, buffer.db_saves_performed),
+			("_total", {"result": "skipped"}, buffer.db_saves_skipped)])
+		add_metric(lines, "db_generation", "gauge", "Generation of the local db changes", [("", None, buffer.db_generation)])
+
+		cycles_stats = list(local._cycles_stats.items())
+		counters = (("runs", "count", "Cycle runs"), ("errors", "errors", "Cycle runs that raised an error"),
+			("missed", "missed", "Cycle deadlines missed"), ("overruns", "overruns", "Cycle runs longer than the period"))
+		for metric, attr, help in counters:
+			samples = [("_total", {"cycle": name}, getattr(stats, attr)) for name, stats in cycles_stats]
+			add_metric(lines, "cycle_" + metric, "counter", help, samples)
+		samples = list()
+		for name, stats in cycles_stats:
+			seen = 0
+			for index, count in enumerate(stats.histogram):
+				if count:
+					seen += count
+					samples.append(("_bucket", {"cycle": name, "le": get_histogram_bucket_max(index) / 1e9}, seen))
+			samples.append(("_bucket", {"cycle": name, "le": "+Inf"}, stats.count))
+			samples.append(("_count", {"cycle": name}, stats.count))
+			samples.append(("_sum", {"cycle": name}, stats.total / 1e9))
+		add_metric(lines, "cycle_duration_seconds", "histogram", "Cycle run duration", samples)
+		lines.append("# EOF\n")
+		return '\n'.join(lines)
 	#end define
 #end class
 
 
-class bcolors:
-	'''This class is designed to display text in color format'''
-	red = "\033[31m"
-	green = "\033[32m"
-	yellow = "\033[33m"
-	blue = "\033[34m"
-	magenta = "\033[35m"
-	cyan = "\033[36m"
-	endc = "\033[0m"
-	bold = "\033[1m"
-	underline = "\033[4m"
-	default = "\033[39m"
+class DataCodec:
+	'''
+	Streaming codec for JSON data: json -> zlib/lzma/zstd -> base64 (optional).
+	The JSON text, the compressed bytes and the base64 text are produced
+	chunk by chunk, so the peak memory stays close to the payload size.
+	Decoding detects the algorithm from the stream, so data written by
+	dict_to_base64_with_compress is readable with any settings. A dictionary
+	from train_dictionary() helps with many small similar payloads, it must
+	be passed to both sides
+	'''
+	chunk_size = 65536
+
+	def __init__(self, algorithm="zlib", level=None, zdict=None, base64=True):
+		if algorithm not in ("zlib", "lzma", "zstd", None):
+			raise Exception(f"DataCodec error: unknown algorithm {algorithm}")
+		self.algorithm = algorithm
+		self.level = level
+		self.zdict = zdict
+		self.base64 = base64
+	#end define
 
-	DEBUG = magenta
-	INFO = blue
-	OKGREEN = green
-	WARNING = yellow
-	ERROR = red
-	ENDC = endc
-	BOLD = bold
-	UNDERLINE = underline
+	def get_compressor(self):
+		if self.algorithm == "zlib":
+			level = -1 if self.level is None else self.level
+			if self.zdict is None:
+				return zlib.compressobj(level)
+			return zlib.compressobj(level, zdict=self.zdict)
+		if self.algorithm == "lzma":
+			return lzma.LZMACompressor(preset=self.level)
+		if self.algorithm == "zstd":
+			zstandard = import_optional("zstandard")
+			if zstandard is None:
+				raise Exception("DataCodec error: zstandard is not installed")
+			dict_data = zstandard.ZstdCompressionDict(self.zdict) if self.zdict else None
+			return zstandard.ZstdCompressor(level=self.level or 3, dict_data=dict_data).compressobj()
+		return None
+	#end define
 
-	def get_args(*args):
-		text = ""
-		for item in args:
+	def get_decompressor(self, head):
+		if head.startswith(b"\xfd7zXZ"):
+			return lzma.LZMADecompressor()
+		if head.startswith(b"\x28\xb5\x2f\xfd"):
+			zstandard = import_optional("zstandard")
+			if zstandard is None:
+				raise Exception("DataCodec error: zstandard is not installed")
+			dict_data = zstandard.ZstdCompressionDict(self.zdict) if self.zdict else None
+			return zstandard.ZstdDecompressor(dict_data=dict_data).decompressobj()
+		# Only the 32 KiB window header (0x78) is written, and JSON can not start with "x".
+		# Other window sizes would also match JSON text such as `80`
+		if len(head) > 1 and head[0] == 0x78 and (head[0] << 8 | head[1]) % 31 == 0:
+			if head[1] & 0x20 and self.zdict is None:
+				raise Exception("DataCodec error: the data needs a zlib dictionary")
+			if self.zdict is None:
+				return zlib.decompressobj()
+			return zlib.decompressobj(zdict=self.zdict)
+		return None  # not compressed
+	#end define
+
+	def iter_encode(self, item):
+		'''Yield the encoded data in chunks of bytes'''
+		compressor = self.get_compressor()
+		pending = b""
+		for data in self.iter_json(item):
+			if compressor is not None:
+				data = compressor.compress(data)
+			pending += data
+			if self.base64 and len(pending) >= 3:
+				cut = len(pending) - len(pending) % 3
+				data = base64.b64encode(pending[:cut])
+				pending = pending[cut:]
+			elif not self.base64:
+				data = pending
+				pending = b""
+			else:
+				continue
+			if data:
+				yield data
+		if compressor is not None:
+			pending += compressor.flush()
+		if pending:
+			yield base64.b64encode(pending) if self.base64 else pending
+	#end define
+
+	def iter_json(self, item):
+		'''JSON text of the item in utf-8 chunks of about chunk_size'''
+		parts = list()
+		size = 0
+		for part in iter_json_parts(item):
+			parts.append(part)
+			size += len(part)
+			if size >= self.chunk_size:
+				yield ''.join(parts).encode("utf-8")
+				parts = list()
+				size = 0
+		if parts:
+			yield ''.join(parts).encode("utf-8")
+	#end define
+
+	def encode(self, item):
+		'''Encoded data, str in base64 mode and bytes in raw mode'''
+		data = b"".join(self.iter_encode(item))
+		return data.decode("ascii") if self.base64 else data
+	#end define
+
+	def encode_stream(self, item, file):
+		'''Write the encoded item into a binary file object'''
+		for data in self.iter_encode(item):
+			file.write(data)
+	#end define
+
+	def decode(self, data):
+		if isinstance(data, str):
+			data = data.encode("ascii")
+		return self.decode_chunks([data])
+	#end define
+
+	def decode_stream(self, file):
+		'''Read an item from a binary file object written by encode_stream'''
+		return self.decode_chunks(iter(functools.partial(file.read, self.chunk_size), b""))
+	#end define
+
+	def decode_chunks(self, chunks):
+		text = bytearray()
+		decompressor = None
+		head = b""
+		for data in self.iter_unbase64(chunks):
+			if decompressor is None:
+				head += data
+				if len(head) < 4:
+					continue
+				decompressor = self.get_decompressor(head) or False
+				data = head
+			if decompressor:
+				data = decompressor.decompress(data)
+			text += data
+		if decompressor is None and head:
+			decompressor = self.get_decompressor(head)
+			text += decompressor.decompress(head) if decompressor else head
+		if decompressor and hasattr(decompressor, "flush"):
+			text += decompressor.flush()
+		return json.loads(text)
+	#end define
+
+	def iter_unbase64(self, chunks):
+		if not self.base64:
+			yield from chunks
+			return
+		pending = b""
+		for data in chunks:
+			pending += data.translate(None, b" \t\r\n")
+			cut = len(pending) - len(pending) % 4
+			if cut:
+				yield base64.b64decode(pending[:cut])
+				pending = pending[cut:]
+		if pending:
+			yield base64.b64decode(pending)
+	#end define
+
+	def train_dictionary(self, samples, size=32768):
+		'''Build a dictionary from sample items, zstd training is used for zstd'''
+		samples = [json.dumps(item).encode("utf-8") for item in samples]
+		if self.algorithm == "zstd":
+			zstandard = import_optional("zstandard")
+			if zstandard is None:
+				raise Exception("DataCodec error: zstandard is not installed")
+			self.zdict = zstandard.train_dictionary(size, samples).as_bytes()
+			return self.zdict
+		# zlib takes up to 32 KiB of preset dictionary and matches the end best,
+		# so the most frequent fragments go last
+		counter = collections.Counter()
+		for sample in samples:
+			counter.update(set(re.findall(rb'"[^"]*": |[^{}\[\],:]+', sample)))
+		fragments = [fragment for fragment, count in counter.most_common() if count > 1]
+		zdict = b""
+		for fragment in fragments:
+			if len(zdict) + len(fragment) + 1 > min(size, 32768):
+				break
+			zdict = fragment + b"," + zdict
+		self.zdict = zdict
+		return zdict
+	#end define
+#end class
+
+
+class HttpResponse:
+	def __init__(self, url, status, reason, headers, body):
+		self.url = url
+		self.status = status
+		self.reason = reason
+		self.headers = headers  # lower case names
+		self.body = body
+		self.from_cache = False
+	#end define
+
+	@property
+	def text(self):
+		content_type = self.headers.get("content-type", "")
+		charset = "utf-8"
+		if "charset=" in content_type:
+			charset = content_type.split("charset=")[-1].split(';')[0].strip()
+		return self.body.decode(charset, "replace")
+	#end define
+
+	def json(self):
+		return json.loads(self.body)
+	#end define
+
+	def copy(self, from_cache=False):
+		response = HttpResponse(self.url, self.status, self.reason, dict(self.headers), self.body)
+		response.from_cache = from_cache
+		return response
+	#end define
+#end class
+
+
+class HttpClient:
+	'''
+	HTTP/1.1 client for get_request and get_own_ip: keep-alive connections
+	pooled per host, a default timeout, retries with exponential backoff for
+	connection errors and 429/5xx answers of idempotent requests, and a cache
+	of GET responses. A cached response is served for `cache_ttl` sec, after
+	that it is revalidated with If-None-Match/If-Modified-Since when the server
+	sent an ETag/Last-Modified, 0 turns the cache off. Responses are cached per
+	URL, caller headers and family. `family=socket.AF_INET` forces IPv4.
+	http_proxy/https_proxy/no_proxy are honoured as by urllib, https goes
+	through the proxy with CONNECT
+	'''
+	idempotent_methods = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+	retry_statuses = (429, 500, 502, 503, 504)
+	redirect_statuses = (301, 302, 303, 307, 308)
+
+	def __init__(self, timeout=10, retries=2, backoff=0.5, pool_size=4, cache_ttl=0, cache_size=256, family=None):
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.pool_size = pool_size
+		self.cache_ttl = cache_ttl
+		self.cache_size = cache_size
+		self.family = family
+		self.headers = {"User-Agent": "mypylib Python/{0}.{1}".format(*sys.version_info)}
+		self.pool = dict()  # (scheme, host, port, family): [idle connections]
+		self.cache = collections.OrderedDict()  # (url, family, caller headers): [expire time, response]
+		self.lock = threading.Lock()
+	#end define
+
+	def get(self, url, **kwargs):
+		return self.request("GET", url, **kwargs)
+	#end define
+
+	def request(self, method, url, headers=None, body=None, timeout=None, retries=None, cache_ttl=None, family=None, redirects=5):
+		method = method.upper()
+		cache_ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+		request_headers = dict(self.headers, **(headers or dict()))
+		cache_key = self.get_cache_key(url, headers, family or self.family)
+		cached = None
+		if method == "GET" and body is None:
+			cached, fresh = self.get_cached(cache_key)
+			if fresh:
+				return cached.copy(from_cache=True)
+			if cached is not None and "etag" in cached.headers:
+				request_headers["If-None-Match"] = cached.headers["etag"]
+			if cached is not None and "last-modified" in cached.headers:
+				request_headers["If-Modified-Since"] = cached.headers["last-modified"]
+		response = self.send(method, url, request_headers, body, timeout, retries, family or self.family)
+		if response.status in self.redirect_statuses and "location" in response.headers and redirects > 0:
+			location = urllib_parse.urljoin(url, response.headers["location"])
+			if response.status == 303 or (response.status in (301, 302) and method == "POST"):
+				method, body = "GET", None
+			return self.request(method, location, headers, body, timeout, retries, cache_ttl, family, redirects - 1)
+		if cached is not None and response.status == 304:
+			headers = dict(cached.headers, **response.headers)
+			response = HttpResponse(url, cached.status, cached.reason, headers, cached.body)
+			response.from_cache = True
+		if method == "GET" and body is None and response.status == 200:
+			self.put_cached(cache_key, response, cache_ttl)
+		return response
+	#end define
+
+	def get_cache_key(self, url, headers, family):
+		'''A response is only reused for the same URL, caller headers and address family'''
+		headers = tuple(sorted((name.lower(), str(value)) for name, value in (headers or dict()).items()))
+		return (url, family, headers)
+	#end define
+
+	def get_cached(self, key):
+		'''return (cached response or None, is it fresh)'''
+		with self.lock:
+			item = self.cache.get(key)
 			if item is None:
+				return None, False
+			self.cache.move_to_end(key)
+		expire_time, response = item
+		return response, time.monotonic() < expire_time
+	#end define
+
+	def put_cached(self, key, response, cache_ttl):
+		'''Expired responses are kept for revalidation by ETag or Last-Modified'''
+		if cache_ttl <= 0:
+			return
+		with self.lock:
+			self.cache[key] = [time.monotonic() + cache_ttl, response.copy()]
+			self.cache.move_to_end(key)
+			while len(self.cache) > self.cache_size:
+				self.cache.popitem(last=False)
+	#end define
+
+	def send(self, method, url, headers, body, timeout, retries, family):
+		parts = urllib_parse.urlsplit(url)
+		path = parts.path or '/'
+		if parts.query:
+			path += '?' + parts.query
+		proxy = self.get_proxy(parts.scheme, parts.hostname)
+		if proxy is not None:
+			family = None  # the proxy resolves the host
+		if proxy is not None and parts.scheme == "http":
+			# A plain http proxy gets the full URL and the credentials with every request
+			path = urllib_parse.urlunsplit(parts._replace(path=path, query='', fragment=''))
+			headers = dict(headers, **get_proxy_headers(proxy))
+		key = (parts.scheme, parts.hostname, parts.port, family, proxy)
+		retries = self.retries if retries is None else retries
+		attempt = 0
+		while True:
+			connection, reused = self.get_connection(key, timeout)
+			try:
+				connection.request(method, path, body=body, headers=headers)
+				answer = connection.getresponse()
+				response = HttpResponse(url, answer.status, answer.reason,
+					{name.lower(): value for name, value in answer.getheaders()}, answer.read())
+			except (OSError, http_client.HTTPException):
+				connection.close()
+				if reused and method in self.idempotent_methods:
+					continue  # the server closed an idle keep-alive connection
+				if attempt >= retries or method not in self.idempotent_methods:
+					raise
+			else:
+				if answer.will_close:
+					connection.close()
+				else:
+					self.release_connection(key, connection)
+				if response.status not in self.retry_statuses or attempt >= retries or method not in self.idempotent_methods:
+					return response
+			time.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+			attempt += 1
+	#end define
+
+	def get_proxy(self, scheme, host):
+		'''Proxy URL from the environment for this scheme and host, None for a direct connection'''
+		proxy = urllib_request.getproxies().get(scheme)
+		if proxy is None or urllib_request.proxy_bypass(host or ''):
+			return None
+		if "://" not in proxy:
+			proxy = "http://" + proxy
+		return proxy
+	#end define
+
+	def get_connection(self, key, timeout):
+		with self.lock:
+			idle = self.pool.get(key)
+			if idle:
+				return idle.pop(), True
+		scheme, host, port, family, proxy = key
+		timeout = self.timeout if timeout is None else timeout
+		if scheme not in ("http", "https"):
+			raise Exception(f"HttpClient error: unsupported scheme {scheme}")
+		if proxy is not None:
+			proxy_parts = urllib_parse.urlsplit(proxy)
+			if scheme == "https":
+				connection = http_client.HTTPSConnection(proxy_parts.hostname, proxy_parts.port, timeout=timeout)
+				connection.set_tunnel(host, port, headers=get_proxy_headers(proxy))
+			else:
+				connection = http_client.HTTPConnection(proxy_parts.hostname, proxy_parts.port, timeout=timeout)
+		elif family is not None:
+			connection = get_family_connection_class(scheme)(host, port, timeout=timeout)
+			connection.family = family
+		elif scheme == "https":
+			connection = http_client.HTTPSConnection(host, port, timeout=timeout)
+		else:
+			connection = http_client.HTTPConnection(host, port, timeout=timeout)
+		return connection, False
+	#end define
+
+	def release_connection(self, key, connection):
+		with self.lock:
+			idle = self.pool.setdefault(key, list())
+			if len(idle) < self.pool_size:
+				idle.append(connection)
+				return
+		connection.close()
+	#end define
+
+	def close(self):
+		with self.lock:
+			pool = self.pool
+			self.pool = dict()
+		for idle in pool.values():
+			for connection in idle:
+				connection.close()
+	#end define
+#end class
+
+
+class FileHasher:
+	'''
+	Hashes many files in parallel on a thread pool (hashlib releases the GIL)
+	and remembers the digests by (path, inode, size, mtime_ns), so unchanged
+	files are not read again. The cache is kept in `cache_path` as JSON
+	'''
+	def __init__(self, algorithm="md5", cache_path=None, executor=None, max_workers=None):
+		get_hasher(algorithm)  # check the algorithm early
+		self.algorithm = algorithm
+		self.cache_path = cache_path
+		self.executor = executor
+		self.max_workers = max_workers
+		self.cache = dict()
+		self.changed = False
+		self.lock = threading.Lock()
+		self.load()
+	#end define
+
+	def load(self):
+		if self.cache_path is None or not os.path.isfile(self.cache_path):
+			return
+		try:
+			with open(self.cache_path, 'rb') as file:
+				data = json.loads(file.read())
+		except ValueError:
+			return
+		if data.get("algorithm") == self.algorithm:
+			self.cache = data.get("files", dict())
+	#end define
+
+	def save(self):
+		with self.lock:
+			if self.cache_path is None or not self.changed:
+				return
+			data = {"algorithm": self.algorithm, "files": self.cache}
+			text = json.dumps(data, separators=(',', ':'))
+			self.changed = False
+		write_file_atomic(self.cache_path, text)
+	#end define
+
+	def hash_file(self, path):
+		path = os.path.abspath(path)
+		stat = os.stat(path)
+		stamp = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+		item = self.cache.get(path)
+		if item is not None and item[:3] == stamp:
+			return item[3]
+		digest = get_file_hash(path, self.algorithm)
+		# A file changed in the same mtime tick as it was hashed would look
+		# unchanged later, so fresh files are not cached (as git does)
+		if time.time_ns() - stat.st_mtime_ns > 2 * 10**9:
+			with self.lock:
+				self.cache[path] = stamp + [digest]
+				self.changed = True
+		return digest
+	#end define
+
+	def try_hash_file(self, path):
+		try:
+			return self.hash_file(path)
+		except OSError:
+			return None
+	#end define
+
+	def hash_files(self, paths):
+		'''return {path: digest}, None for files that can not be read'''
+		paths = list(paths)
+		if self.executor is not None:
+			digests = list(self.executor.map(self.try_hash_file, paths))
+		else:
+			with concurrent_futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hasher") as executor:
+				digests = list(executor.map(self.try_hash_file, paths))
+		self.save()
+		return dict(zip(paths, digests))
+	#end define
+
+	def forget_missing(self):
+		'''Drop the cache entries of deleted files'''
+		with self.lock:
+			for path in [path for path in self.cache if not os.path.exists(path)]:
+				del self.cache[path]
+				self.changed = True
+	#end define
+#end class
+
+
+class DirIndex:
+	'''
+	Index of the file and directory names under `root`. The tree is walked once
+	(top level subtrees in parallel when an executor or max_workers is given),
+	lookups are dict hits and refresh() rescans only the directories whose
+	mtime changed. Hidden entries are skipped like in search_file_in_dir,
+	symlinked directories are not followed
+	'''
+	def __init__(self, root, executor=None, max_workers=None, hidden=False):
+		self.root = os.path.abspath(root)
+		self.executor = executor
+		self.max_workers = max_workers
+		self.hidden = hidden
+		self.dirs = dict()  # dir path: [mtime_ns, file names, dir names]
+		self.files_by_name = dict()
+		self.dirs_by_name = dict()
+		self.build()
+	#end define
+
+	def build(self):
+		item = self.scan_dir(self.root)
+		dirs = {self.root: item}
+		dirs.update(self.walk_many([os.path.join(self.root, name) for name in item[2]]))
+		self.dirs = dirs
+		self.update_names()
+	#end define
+
+	def refresh(self):
+		'''Rescan the directories changed since the last walk, return True if anything changed'''
+		changed = list()
+		for path, item in list(self.dirs.items()):
+			try:
+				mtime = os.stat(path).st_mtime_ns
+			except OSError:
+				mtime = None
+			if mtime != item[0]:
+				changed.append(path)
+		if len(changed) == 0:
+			return False
+		new_dirs = list()
+		for path in changed:
+			old_item = self.dirs.get(path)
+			if old_item is None:
+				continue  # dropped together with its parent
+			try:
+				item = self.scan_dir(path)
+			except OSError:
+				self.drop(path)
 				continue
-			text += str(item)
-		return text
+			self.dirs[path] = item
+			for name in set(old_item[2]) - set(item[2]):
+				self.drop(os.path.join(path, name))
+			old_names = set(old_item[2])
+			new_dirs += [os.path.join(path, name) for name in item[2] if name not in old_names]
+		self.dirs.update(self.walk_many(new_dirs))
+		self.update_names()
+		return True
 	#end define
 
-	def magenta_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.magenta + text + bcolors.endc
-		return text
+	def drop(self, path):
+		item = self.dirs.pop(path, None)
+		if item is None:
+			return
+		for name in item[2]:
+			self.drop(os.path.join(path, name))
 	#end define
 
-	def blue_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.blue + text + bcolors.endc
-		return text
+	def scan_dir(self, path):
+		mtime = os.stat(path).st_mtime_ns
+		files = list()
+		dirs = list()
+		with os.scandir(path) as entries:
+			for entry in entries:
+				if not self.hidden and entry.name.startswith('.'):
+					continue
+				if entry.is_dir(follow_symlinks=False):
+					dirs.append(entry.name)
+				elif entry.is_file():
+					files.append(entry.name)
+		return [mtime, files, dirs]
 	#end define
 
-	def green_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.green + text + bcolors.endc
-		return text
+	def walk(self, path):
+		'''return {dir path: scan} of the subtree of `path`'''
+		result = dict()
+		stack = [path]
+		while len(stack) > 0:
+			dir_path = stack.pop()
+			try:
+				item = self.scan_dir(dir_path)
+			except OSError:
+				continue
+			result[dir_path] = item
+			stack += [os.path.join(dir_path, name) for name in reversed(item[2])]
+		return result
 	#end define
 
-	def yellow_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.yellow + text + bcolors.endc
-		return text
+	def walk_many(self, paths):
+		if len(paths) > 1 and self.executor is not None:
+			results = list(self.executor.map(self.walk, paths))
+		elif len(paths) > 1 and self.max_workers:
+			with concurrent_futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dir_index") as executor:
+				results = list(executor.map(self.walk, paths))
+		else:
+			results = [self.walk(path) for path in paths]
+		result = dict()
+		for item in results:
+			result.update(item)
+		return result
 	#end define
 
-	def red_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.red + text + bcolors.endc
-		return text
+	def update_names(self):
+		files_by_name = dict()
+		dirs_by_name = dict()
+		for path, (mtime, file_names, dir_names) in self.dirs.items():
+			for name in file_names:
+				files_by_name.setdefault(name, list()).append(os.path.join(path, name))
+			for name in dir_names:
+				dirs_by_name.setdefault(name, list()).append(os.path.join(path, name))
+		self.files_by_name = files_by_name
+		self.dirs_by_name = dirs_by_name
 	#end define
 
-	def bold_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.bold + text + bcolors.endc
-		return text
+	def find_file(self, name):
+		paths = self.files_by_name.get(name)
+		return paths[0] if paths else None
 	#end define
 
-	def underline_text(*args):
-		text = bcolors.get_args(*args)
-		text = bcolors.underline + text + bcolors.endc
-		return text
+	def find_dir(self, name):
+		paths = self.dirs_by_name.get(name)
+		return paths[0] if paths else None
 	#end define
 
-	colors = {"red": red, "green": green, "yellow": yellow, "blue": blue, "magenta": magenta, "cyan": cyan,
-			  "endc": endc, "bold": bold, "underline": underline}
+	def find_files(self, pattern=None, regex=None):
+		'''All files whose name matches the glob `pattern` and whose path matches `regex`'''
+		return find_in_names(self.files_by_name, pattern, regex)
+	#end define
+
+	def find_dirs(self, pattern=None, regex=None):
+		'''All directories whose name matches the glob `pattern` and whose path matches `regex`'''
+		return find_in_names(self.dirs_by_name, pattern, regex)
+	#end define
 #end class
 
 
+def cache_method(func):
+	'''Compute a method without arguments once per instance'''
+	name = "_cache_" + func.__name__
+	@functools.wraps(func)
+	def wrapper(self):
+		try:
+			return self.__dict__[name]
+		except KeyError:
+			result = self.__dict__[name] = func(self)
+			return result
+	return wrapper
+#end define
+
+def clear_method_cache(obj):
+	'''Forget the values computed by cache_method'''
+	for name in [name for name in obj.__dict__ if name.startswith("_cache_")]:
+		del obj.__dict__[name]
+#end define
+
+
 class MyPyClass:
 	def __init__(self, file):
 		self.working = True
 		self.file = file
-		self.db = Dict()
+		self.db = TrackedDict()
 		self.db.config = Dict()
 
 		self.buffer = Dict()
-		self.buffer.old_db = Dict()
-		self.buffer.log_list = list()
+		self.buffer.startup_times = Dict()
+		self._startup_time = time.perf_counter()
+		self._old_db = Dict()
+		self.buffer.log_dropped = 0
+		self.buffer.db_generation = None
+		self.buffer.db_full_save_time = 0
+		self.buffer.db_saves_skipped = 0
+		self.buffer.db_saves_performed = 0
 		self.buffer.thread_count = None
 		self.buffer.memory_using = None
 		self.buffer.free_space_memory = None
 
 		self.refresh()
+		self.mark_startup("refresh")
 		self._tlock = threading.RLock()
-		self._flock = filelock.FileLock(
-			self.buffer.db_lock_path,
-			is_singleton=True,
-			poll_interval=0.01,
-			timeout=3,
-		)
+		self._flock = None
+		self._log_level = INFO_LEVEL
+		self._log_ignore_warning = False
+		self._log_sink = LogSink(self)
+		self._log_rotator = LogRotator(self)
+		self._stop_event = threading.Event()
+		self._scheduler = Scheduler(self, self._stop_event)
+		self._thread_pool = None
+		self._process_pool = None
+		self._pool_lock = threading.RLock()  # exit() shuts the pools down from a signal handler
+		self._cycles_stats = dict()
+		self._metrics = MetricsExporter(self)
+		self._sampler = ResourceSampler()
+		self._tracemalloc_snapshot = None
+		self._profiler = StackSampler(self)
+		self._hashers = dict()
+		self._log_file = None
+		self._loop = None
+		self._loop_thread_id = None
+		self._async_stop = None
+		self._tasks = set()
 		self.initialize()
+		self.mark_startup("initialize")
+	#end define
+
+	def mark_startup(self, phase):
+		'''Add the time since the previous mark to buffer.startup_times, ms'''
+		time_now = time.perf_counter()
+		startup_times = self.buffer.startup_times
+		startup_times[phase] = round((time_now - self._startup_time) * 1000, 3)
+		startup_times.total = round(sum(value for key, value in startup_times.items() if key != "total"), 3)
+		self._startup_time = time_now
+	#end define
+
+	def print_startup_times(self):
+		startup_times = self.buffer.startup_times
+		text = ", ".join(f"{key} {value}ms" for key, value in startup_times.items() if key != "total")
+		self.add_log(f"Startup time: {startup_times.total}ms ({text})")
 	#end define
 
 	def start_service(self, service_name: str, sleep: int = 1):
@@ -186,6 +2506,7 @@ class MyPyClass:
 
 	def refresh(self):
 		# Get program, log and database file name
+		clear_method_cache(self)
 		user = get_username()
 		my_name = self.get_my_name()
 		my_work_dir = self.get_my_work_dir()
@@ -209,7 +2530,10 @@ class MyPyClass:
 
 		# Load local database
 		self.load_db()
+		self.mark_startup("load_db")
 		self.set_default_config()
+		self.apply_log_config()
+		self._log_sink.start()
 
 		# Remove old log file
 		if self.db.config.isDeleteOldLogFile and os.path.isfile(self.buffer.log_file_name):
@@ -219,6 +2543,9 @@ class MyPyClass:
 		# Catch the shutdown signal
 		signal.signal(signal.SIGINT, self.exit)
 		signal.signal(signal.SIGTERM, self.exit)
+		profiler_signal = getattr(signal, "SIGUSR1", None)
+		if self.db.config.isProfilerSignal and profiler_signal is not None:
+			signal.signal(profiler_signal, self.profile_signal)
 		# Save on normal interpreter exit
 		atexit.register(self.save)
 	#end define
@@ -238,21 +2565,36 @@ class MyPyClass:
 		if "--add2cron" in sys.argv:
 			self.add_to_crone()
 
+		self.apply_log_config()
+		self._sampler.configure(self.db.config)
+		if self.db.config.memoryGuardLimit and "tracemalloc" in self.db.config.memoryGuardActions:
+			self.start_tracemalloc()
+
 		# Start only one process (exit if process exist)
 		if self.db.config.isStartOnlyOneProcess:
 			self.start_only_one_process()
 		#end if
 
-		# Start other threads
-		self.start_cycle(self.self_test, sec=1)
-		if self.db.config.isWritingLogFile is True:
-			self.start_cycle(self.write_log, sec=1)
-		if self.db.config.isLocaldbSaving is True:
-			self.start_cycle(self.save_db, sec=1)
+		# Start other threads, or tasks if the service runs on an event loop
+		if self._loop is not None:
+			self.start_async_cycle(self.self_test, sec=1)
+			if self.db.config.isLocaldbSaving is True:
+				self.start_async_cycle(self.save_db, sec=1)
+		else:
+			self.start_cycle(self.self_test, sec=1, reserved=True)
+			if self.db.config.isLocaldbSaving is True:
+				self.start_cycle(self.save_db, sec=1, reserved=True)
+		if self.db.config.isMetricsServer is True:
+			self.start_metrics_server()
+		if self.db.config.metricsTextfile:
+			self.start_cycle(self.write_metrics, sec=self.db.config.metricsTextfileInterval)
 		self.buffer.thread_count_old = threading.active_count()
 
 		# Logging the start of the program
+		self.mark_startup("run")
 		self.add_log(f"Start program `{self.buffer.my_path}`")
+		if self.is_enabled(DEBUG):
+			self.print_startup_times()
 	#end define
 
 	def set_default_config(self):
@@ -270,10 +2612,80 @@ class MyPyClass:
 			self.db.config.memoryUsinglimit = 50
 		if self.db.config.isLocaldbSaving is None:
 			self.db.config.isLocaldbSaving = False
+		if self.db.config.isLocaldbJournal is None:
+			self.db.config.isLocaldbJournal = False
+		if self.db.config.localdbWalMaxSize is None:
+			self.db.config.localdbWalMaxSize = 1024 * 1024
+		if self.db.config.localdbFormat is None:
+			self.db.config.localdbFormat = "json"  # json || json-compact || orjson || ujson || msgpack
+		if "localdbCompression" not in self.db.config:
+			self.db.config.localdbCompression = None  # None || zlib || zstd
+		if self.db.config.localdbFullSaveInterval is None:
+			self.db.config.localdbFullSaveInterval = 60  # sec
+		if self.db.config.localdbCompactInterval is None:
+			self.db.config.localdbCompactInterval = 600  # sec
 		if self.db.config.isWritingLogFile is None:
 			self.db.config.isWritingLogFile = True
 		if self.db.config.logFileSizeLines is None:
 			self.db.config.logFileSizeLines = 16384
+		if self.db.config.logFileMaxSize is None:
+			self.db.config.logFileMaxSize = 16 * 1024 * 1024
+		if self.db.config.logRotateInterval is None:
+			self.db.config.logRotateInterval = 0  # sec, 0 = off
+		if self.db.config.logRotateCount is None:
+			self.db.config.logRotateCount = 5
+		if self.db.config.logRotateMaxBytes is None:
+			self.db.config.logRotateMaxBytes = 0  # 0 = unlimited
+		if self.db.config.logRotateMaxAge is None:
+			self.db.config.logRotateMaxAge = 0  # sec, 0 = unlimited
+		if self.db.config.isCompressLogFile is None:
+			self.db.config.isCompressLogFile = True
+		if self.db.config.isProfilerSignal is None:
+			self.db.config.isProfilerSignal = True
+		if self.db.config.profilerDuration is None:
+			self.db.config.profilerDuration = 10
+		if self.db.config.profilerInterval is None:
+			self.db.config.profilerInterval = 0.005
+		if self.db.config.memoryGuardLimit is None:
+			self.db.config.memoryGuardLimit = 0  # 0 = guard mode off
+		if self.db.config.memoryGuardActions is None:
+			self.db.config.memoryGuardActions = ["warn"]  # warn, tracemalloc, gc, restart
+		if self.db.config.memoryGuardInterval is None:
+			self.db.config.memoryGuardInterval = 60
+		if self.db.config.memoryGuardTracemallocFrames is None:
+			self.db.config.memoryGuardTracemallocFrames = 1
+		if self.db.config.memoryGuardTopCount is None:
+			self.db.config.memoryGuardTopCount = 10
+		if self.db.config.resourceSampleMinInterval is None:
+			self.db.config.resourceSampleMinInterval = 1
+		if self.db.config.resourceSampleMaxInterval is None:
+			self.db.config.resourceSampleMaxInterval = 10
+		if self.db.config.resourceHistorySize is None:
+			self.db.config.resourceHistorySize = 600
+		if self.db.config.isMetricsServer is None:
+			self.db.config.isMetricsServer = False
+		if self.db.config.metricsHost is None:
+			self.db.config.metricsHost = "127.0.0.1"
+		if self.db.config.metricsPort is None:
+			self.db.config.metricsPort = 9464
+		if self.db.config.metricsTextfileInterval is None:
+			self.db.config.metricsTextfileInterval = 15
+		if self.db.config.threadPoolSize is None:
+			self.db.config.threadPoolSize = 0  # 0 = auto
+		if self.db.config.processPoolSize is None:
+			self.db.config.processPoolSize = 0  # 0 = number of CPUs
+		if self.db.config.schedulerMaxWorkers is None:
+			self.db.config.schedulerMaxWorkers = 8
+		if self.db.config.logFormat is None:
+			self.db.config.logFormat = "text"  # text || json
+		if self.db.config.logQueueSize is None:
+			self.db.config.logQueueSize = 65536
+		if self.db.config.logQueueOverflow is None:
+			self.db.config.logQueueOverflow = "drop"  # drop || block
+		if self.db.config.logFlushInterval is None:
+			self.db.config.logFlushInterval = 1
+		if self.db.config.logFlushBytes is None:
+			self.db.config.logFlushBytes = 65536
 	#end define
 
 	def start_only_one_process(self):
@@ -303,33 +2715,187 @@ class MyPyClass:
 			file.write(pid_str)
 	#end define
 
-	def self_test(self):
-		process = psutil.Process(os.getpid())
-		memory_using = b2mb(process.memory_info().rss)
-		free_space_memory = b2mb(psutil.virtual_memory().available)
-		thread_count = threading.active_count()
-		self.buffer.free_space_memory = free_space_memory
-		self.buffer.memory_using = memory_using
-		self.buffer.thread_count = thread_count
-		if memory_using > self.db.config.memoryUsinglimit:
-			self.db.config.memoryUsinglimit += 50
-			self.add_log(f"Memory using: {memory_using}Mb, free: {free_space_memory}Mb", WARNING)
+	def self_test(self):
+		self.buffer.thread_count = threading.active_count()
+		self.get_cycles_stats()
+		sample = self._sampler.sample_if_due()
+		if sample is None:
+			return
+		memory_using = b2mb(sample.rss)
+		free_space_memory = b2mb(sample.available_memory)
+		self.buffer.free_space_memory = free_space_memory
+		self.buffer.memory_using = memory_using
+		self.buffer.cpu_percent = sample.cpu_percent
+		self.buffer.fd_count = sample.fds
+		self.buffer.ctx_switches_voluntary = sample.ctx_switches_voluntary
+		self.buffer.ctx_switches_involuntary = sample.ctx_switches_involuntary
+		self.buffer.io_read_bytes = sample.io_read_bytes
+		self.buffer.io_write_bytes = sample.io_write_bytes
+		if self.db.config.memoryGuardLimit:
+			self.check_memory_guard(memory_using, free_space_memory)
+		elif memory_using > self.db.config.memoryUsinglimit:
+			self.db.config.memoryUsinglimit += 50
+			self.add_log(f"Memory using: {memory_using}Mb, free: {free_space_memory}Mb", WARNING)
+	#end define
+
+	def print_self_testing_result(self):
+		thread_count_old = self.buffer.thread_count_old
+		thread_count_new = self.buffer.thread_count
+		memory_using = self.buffer.memory_using
+		free_space_memory = self.buffer.free_space_memory
+		self.add_log(color_text("{blue}Self testing informatinon:{endc}"))
+		self.add_log(f"Threads: {thread_count_new} -> {thread_count_old}")
+		self.add_log(f"Memory using: {memory_using}Mb, free: {free_space_memory}Mb")
+		self.add_log(f"Local db saves: {self.buffer.db_saves_performed} performed, {self.buffer.db_saves_skipped} skipped")
+		self.print_cycles_stats()
+	#end define
+
+	def start_metrics_server(self, host=None, port=None):
+		'''Serve OpenMetrics on http://host:port/metrics, port 0 picks a free port'''
+		host = host or self.db.config.metricsHost
+		port = self.db.config.metricsPort if port is None else port
+		port = self._metrics.start(host, port)
+		self.buffer.metrics_port = port
+		self.add_log(f"Metrics server started on {host}:{port}", DEBUG)
+		return port
+	#end define
+
+	def get_metrics(self):
+		return self._metrics.render()
+	#end define
+
+	def write_metrics(self, path=None):
+		'''Write metrics for the node_exporter textfile collector'''
+		path = path or self.db.config.metricsTextfile
+		self._metrics.write_textfile(path)
+	#end define
+
+	def check_memory_guard(self, memory_using, free_space_memory):
+		'''
+		Memory guard mode: memoryUsinglimit is a soft limit (warning) and
+		memoryGuardLimit a hard one that runs the memoryGuardActions:
+		warn, tracemalloc (log the top allocators since the last report), gc, restart
+		'''
+		config = self.db.config
+		if memory_using <= config.memoryUsinglimit:
+			return
+		time_now = time.time()
+		if time_now - (self.buffer.memory_guard_time or 0) < config.memoryGuardInterval:
+			return
+		self.buffer.memory_guard_time = time_now
+		if memory_using <= config.memoryGuardLimit:
+			self.add_log(f"Memory using: {memory_using}Mb, free: {free_space_memory}Mb", WARNING)
+			return
+		self.buffer.memory_guard_triggered = (self.buffer.memory_guard_triggered or 0) + 1
+		actions = config.memoryGuardActions
+		if "warn" in actions:
+			self.add_log(f"Memory guard: using {memory_using}Mb > limit {config.memoryGuardLimit}Mb, free: {free_space_memory}Mb", ERROR)
+		if "tracemalloc" in actions:
+			self.log_tracemalloc_diff()
+		if "gc" in actions:
+			collected = gc.collect()
+			memory_after = b2mb(self._sampler.process.memory_info().rss)
+			self.add_log(f"Memory guard: gc collected {collected} objects, memory using {memory_using}Mb -> {memory_after}Mb", WARNING)
+		if "restart" in actions:
+			self.add_log("Memory guard: restarting the service", ERROR)
+			os.kill(os.getpid(), signal.SIGTERM)
+	#end define
+
+	def profile_signal(self, signum=None, frame=None):
+		self.start_profiler()
+	#end define
+
+	def start_profiler(self, duration=None, interval=None):
+		'''
+		Sample all thread stacks for `duration` sec and write them to
+		my_temp_dir/<name>_<time>.collapsed. Also started by `kill -USR1 <pid>`
+		'''
+		duration = duration or self.db.config.profilerDuration
+		interval = interval or self.db.config.profilerInterval
+		if not self._profiler.start(duration, interval):
+			self.add_log("Profiler is already running", WARNING)
+			return None
+		self.add_log(f"Profiler started for {duration} sec", INFO)
+		return self._profiler.thread
+	#end define
+
+	def start_tracemalloc(self):
+		if not tracemalloc.is_tracing():
+			tracemalloc.start(self.db.config.memoryGuardTracemallocFrames)
+		self._tracemalloc_snapshot = self.take_tracemalloc_snapshot()
+	#end define
+
+	def take_tracemalloc_snapshot(self):
+		filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+		return tracemalloc.take_snapshot().filter_traces(filters)
+	#end define
+
+	def log_tracemalloc_diff(self):
+		'''Log the allocators that grew most since the previous snapshot'''
+		if not tracemalloc.is_tracing() or self._tracemalloc_snapshot is None:
+			self.start_tracemalloc()
+			self.add_log("Memory guard: tracemalloc started, top allocators will be shown on the next report", WARNING)
+			return
+		snapshot = self.take_tracemalloc_snapshot()
+		key_type = "traceback" if self.db.config.memoryGuardTracemallocFrames > 1 else "lineno"
+		stats = snapshot.compare_to(self._tracemalloc_snapshot, key_type)
+		self._tracemalloc_snapshot = snapshot
+		self.add_log(f"Memory guard: top allocators, traced {b2mb(tracemalloc.get_traced_memory()[0])}Mb", WARNING)
+		for stat in stats[:self.db.config.memoryGuardTopCount]:
+			text = f"{stat.size_diff / 1024:+.1f} KiB ({stat.size / 1024:.1f} KiB), {stat.count_diff:+} blocks: "
+			text += " <- ".join(str(frame) for frame in stat.traceback)
+			self.add_log(text, WARNING)
+	#end define
+
+	def get_file_hasher(self, algorithm="md5"):
+		'''FileHasher on the managed thread pool, with the cache in my_work_dir'''
+		hasher = self._hashers.get(algorithm)
+		if hasher is None:
+			cache_path = self.buffer.my_work_dir + self.buffer.my_name + f".{algorithm}.hashes"
+			hasher = FileHasher(algorithm, cache_path, executor=self.get_thread_pool())
+			hasher = self._hashers.setdefault(algorithm, hasher)
+		return hasher
+	#end define
+
+	def hash_files(self, paths, algorithm="md5"):
+		return self.get_file_hasher(algorithm).hash_files(paths)
+	#end define
+
+	def get_resource_history(self, field=None, since=None):
+		'''History of self_test resource samples, e.g. get_resource_history("rss", time.time() - 60)'''
+		return self._sampler.get_history(field, since)
+	#end define
+
+	def get_cycle_stats(self, name):
+		stats = self._cycles_stats.get(name)
+		if stats is None:
+			stats = self._cycles_stats.setdefault(name, CycleStats(name))
+		return stats
 	#end define
 
-	def print_self_testing_result(self):
-		thread_count_old = self.buffer.thread_count_old
-		thread_count_new = self.buffer.thread_count
-		memory_using = self.buffer.memory_using
-		free_space_memory = self.buffer.free_space_memory
-		self.add_log(color_text("{blue}Self testing informatinon:{endc}"))
-		self.add_log(f"Threads: {thread_count_new} -> {thread_count_old}")
-		self.add_log(f"Memory using: {memory_using}Mb, free: {free_space_memory}Mb")
+	def get_cycles_stats(self):
+		'''Plain data of all cycles and threads, also kept in buffer.cycles_stats'''
+		result = Dict()
+		for name, stats in list(self._cycles_stats.items()):
+			result[name] = stats.get_data()
+		self.buffer.cycles_stats = result
+		return result
+	#end define
+
+	def print_cycles_stats(self):
+		cycles_stats = self.get_cycles_stats()
+		self.add_log(color_text("{blue}Cycles informatinon:{endc}"))
+		for name, data in cycles_stats.items():
+			text = f"{name}: {data.count} runs, {data.errors} errors, {data.missed} missed, {data.overruns} overruns; "
+			text += f"last {data.last:.3f}ms, min {data.min:.3f}ms, avg {data.avg:.3f}ms, p99 {data.p99:.3f}ms, max {data.max:.3f}ms"
+			self.add_log(text)
 	#end define
 
 	def get_thread_name(self):
 		return threading.current_thread().name
 	#end define
 
+	@cache_method
 	def get_my_full_name(self):
 		'''return "test.py"'''
 		my_path = self.get_my_path()
@@ -339,6 +2905,7 @@ class MyPyClass:
 		return my_full_name
 	#end define
 
+	@cache_method
 	def get_my_name(self):
 		'''return "test"'''
 		my_full_name = self.get_my_full_name()
@@ -346,12 +2913,14 @@ class MyPyClass:
 		return my_name
 	#end define
 
+	@cache_method
 	def get_my_path(self):
 		'''return "/some_dir/test.py"'''
 		my_path = os.path.abspath(self.file)
 		return my_path
 	#end define
 
+	@cache_method
 	def get_my_dir(self):
 		'''return "/some_dir/"'''
 		my_path = self.get_my_path()
@@ -361,6 +2930,7 @@ class MyPyClass:
 		return my_dir
 	#end define
 
+	@cache_method
 	def get_my_work_dir(self):
 		'''return "/usr/local/bin/test/" or "/home/user/.local/share/test/"'''
 		if self.check_root_permission():
@@ -375,6 +2945,7 @@ class MyPyClass:
 		return my_work_dir
 	#end define
 
+	@cache_method
 	def get_my_temp_dir(self):
 		'''return "/tmp/test/"'''
 		temp_files_dir = "/tmp/"  # https://ru.wikipedia.org/wiki/FHS
@@ -392,113 +2963,98 @@ class MyPyClass:
 		return lang
 	#end define
 
+	@cache_method
 	def check_root_permission(self):
-		process = subprocess.run(["touch", "/checkpermission"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-		if process.returncode == 0:
-			subprocess.run(["rm", "/checkpermission"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-			result = True
-		else:
-			result = False
-		return result
+		'''True if the process may write to "/", checked without spawning a process'''
+		if os.access in os.supports_effective_ids:
+			return os.access('/', os.W_OK, effective_ids=True)
+		geteuid = getattr(os, "geteuid", None)
+		return geteuid is not None and geteuid() == 0
 	#end define
 
-	def add_log(self, input_text, mode=INFO):
-		input_text = f"{input_text}"
-		time_text = date_time_library.datetime.utcnow().strftime("%d.%m.%Y, %H:%M:%S.%f")[:-3]
-		time_text = "{0} (UTC)".format(time_text).ljust(32, ' ')
-
-		# Pass if set log level
-		if self.db.config.logLevel != DEBUG and mode == DEBUG:
-			return
-		elif self.db.config.isIgnorLogWarning and mode == WARNING:
-			return
-
-		# Set color mode
-		if mode == INFO:
-			color_start = bcolors.INFO + bcolors.BOLD
-		elif mode == WARNING:
-			color_start = bcolors.WARNING + bcolors.BOLD
-		elif mode == ERROR:
-			color_start = bcolors.ERROR + bcolors.BOLD
-		elif mode == DEBUG:
-			color_start = bcolors.DEBUG + bcolors.BOLD
-		else:
-			color_start = bcolors.UNDERLINE + bcolors.BOLD
-		mode_text = "{0}{1}{2}".format(color_start, "[{0}]".format(mode).ljust(10, ' '), bcolors.ENDC)
+	def apply_log_config(self):
+		'''Cache the log settings outside of the config Dict'''
+		config = self.db.config
+		self._log_level = LOG_LEVELS.get(config.logLevel, INFO_LEVEL)
+		self._log_ignore_warning = bool(config.isIgnorLogWarning)
+		self._log_sink.configure(config)
+	#end define
 
-		# Set color thread
-		if mode == ERROR:
-			color_start = bcolors.ERROR + bcolors.BOLD
-		else:
-			color_start = bcolors.OKGREEN + bcolors.BOLD
-		thread_text = "{0}{1}{2}".format(color_start, "<{0}>".format(self.get_thread_name()).ljust(14, ' '), bcolors.ENDC)
-		log_text = mode_text + time_text + thread_text + input_text
+	def set_log_level(self, mode):
+		self.db.config.logLevel = mode
+		self.apply_log_config()
+	#end define
 
-		# Queue for recording
-		self.buffer.log_list.append(log_text)
+	def is_enabled(self, mode):
+		level = LOG_LEVELS.get(mode, INFO_LEVEL)
+		if level < self._log_level:
+			return False
+		return level != WARNING_LEVEL or not self._log_ignore_warning
+	#end define
 
-		# Print log text
-		print(log_text)
+	def add_log(self, input_text, mode=INFO, *args, extra=None, lazy=False):
+		'''
+		Log `input_text` with the level `mode`.
+		`input_text` may be a %-format string with deferred `args`, or with
+		`lazy=True` a function that returns the text. Both are evaluated only if
+		the record passes the level filter.
+		`extra` fields are stored in the record when logFormat is "json"
+		'''
+		level = LOG_LEVELS.get(mode, INFO_LEVEL)
+		if level < self._log_level or (level == WARNING_LEVEL and self._log_ignore_warning):
+			return
+		if lazy:
+			input_text = input_text()
+		if args:
+			input_text = input_text % args
+
+		# Queue for recording, the sink thread formats and prints it
+		record = (time.time_ns(), mode, threading.current_thread().name, f"{input_text}", extra)
+		self._log_sink.put(record, urgent=(level == ERROR_LEVEL))
 	#end define
 
 	def write_log(self):
-		log_file_name = self.buffer.log_file_name
+		self._log_sink.flush()
+	#end define
 
-		with open(log_file_name, 'a') as file:
-			while len(self.buffer.log_list) > 0:
-				log_text = self.buffer.log_list.pop(0)
-				file.write(log_text + '\n')
-			#end while
-		#end with
+	def write_log_text(self, text):
+		self._log_rotator.write(self.buffer.log_file_name, text)
+	#end define
 
-		# Control log size
-		if self.db.config.isLimitLogFile is False:
-			return
-		log_size = self.db.config.logFileSizeLines or 16384
-		allline = self.count_lines(log_file_name)
-		if allline > log_size + 256:
-			delline = allline - log_size
-			f = open(log_file_name).readlines()
-			i = 0
-			while i < delline:
-				f.pop(0)
-				i = i + 1
-			with open(log_file_name, 'w') as F:
-				F.writelines(f)
-	#end define
-
-	def count_lines(self, filename, chunk_size=1 << 13):
-		if not os.path.isfile(filename):
-			return 0
-		with open(filename) as file:
-			return sum(chunk.count('\n')
-				for chunk in iter(lambda: file.read(chunk_size), ''))
+	def count_lines(self, filename, chunk_size=1 << 24):
+		return count_file_lines(filename, chunk_size)
 	#end define
 
-	def dict_to_base64_with_compress(self, item):
-		string = json.dumps(item)
-		original = string.encode("utf-8")
-		compressed = zlib.compress(original)
-		b64 = base64.b64encode(compressed)
-		data = b64.decode("utf-8")
-		return data
+	def get_log_file(self):
+		'''LogFile of the service log: tail(), follow(), query(start, end)'''
+		if self._log_file is None or self._log_file.path != self.buffer.log_file_name:
+			self._log_file = LogFile(self.buffer.log_file_name)
+		return self._log_file
+	#end define
+
+	def dict_to_base64_with_compress(self, item, algorithm="zlib", level=None):
+		'''See DataCodec for streaming, raw bytes and dictionaries'''
+		return DataCodec(algorithm, level).encode(item)
 	#end define
 
 	def base64_to_dict_with_decompress(self, item):
-		data = item.encode("utf-8")
-		b64 = base64.b64decode(data)
-		decompress = zlib.decompress(b64)
-		original = decompress.decode("utf-8")
-		data = json.loads(original)
-		return data
+		return DataCodec().decode(item)
 	#end define
 
 	def exit(self, signum=None, frame=None):
+		self.shutdown()
+		sys.exit(0)
+	#end define
+
+	def shutdown(self):
 		self.working = False
+		self._scheduler.stop()
+		self._metrics.stop()
+		self.shutdown_pools()
 		if os.path.isfile(self.buffer.pid_file_path):
 			os.remove(self.buffer.pid_file_path)
 		self.save()
-		sys.exit(0)
+		self._log_sink.stop()
 	#end define
 
 	def read_file(self, path):
@@ -508,19 +3064,7 @@ class MyPyClass:
 	#end define
 
 	def write_file(self, path, text=""):
-		dir = os.path.dirname(path)
-		name = os.path.basename(path)
-		fd, tmp = tempfile.mkstemp(dir=dir, prefix=f".{name}.")
-		try:
-			with os.fdopen(fd, "wt") as file:
-				file.write(text)
-			os.replace(tmp, path)
-		except:
-			try:
-				os.remove(tmp)
-			except OSError:
-				pass
-			raise
+		write_file_atomic(path, text)
 	#end define
 
 	def read_db(self, db_path):
@@ -535,15 +3079,75 @@ class MyPyClass:
 	#end define
 
 	def read_db_process(self, db_path):
-		text = self.read_file(db_path)
-		data = json.loads(text)
-		return Dict(data)
+		with open(db_path, 'rb') as file:
+			raw = file.read()
+		config = self.db.config or Dict()
+		data, db_format, compression = decode_db_data(raw, fast=config.localdbFormat == "orjson")
+		if db_path == self.buffer.db_path:
+			self.buffer.db_file_format = [db_format, compression]
+		self.read_db_wal(data, db_path)
+		return LazyDict(data)
+	#end define
+
+	def read_db_wal(self, data, db_path):
+		wal_path = db_path + ".wal"
+		if not os.path.isfile(wal_path):
+			return
+		base_ino = os.stat(db_path).st_ino
+		with open(wal_path, 'rt') as file:
+			for i, line in enumerate(file):
+				if not line.endswith('\n'):
+					break  # torn write
+				item = json.loads(line)
+				if i == 0 and item.get("base") != base_ino:
+					return  # journal of an older db file
+				if i > 0:
+					apply_db_wal_item(data, item)
 	#end define
 
 	def write_db(self, data):
 		db_path = self.buffer.db_path
-		text = json.dumps(data, indent=4)
-		self.write_file(db_path, text)
+		db_format = self.db.config.localdbFormat or "json"
+		compression = self.db.config.localdbCompression
+		if isinstance(data, LazyDict):
+			data = data._freeze()
+		raw = encode_db_data(data, db_format, compression)
+		self.write_file(db_path, raw)
+		self.buffer.db_file_format = [get_db_format_kind(db_format), compression]
+		if os.path.isfile(db_path + ".wal"):
+			os.remove(db_path + ".wal")
+	#end define
+
+	def write_db_wal(self, paths):
+		db_path = self.buffer.db_path
+		wal_path = db_path + ".wal"
+		lines = list()
+		if not os.path.isfile(wal_path):
+			lines.append(json.dumps({"base": os.stat(db_path).st_ino}))
+		for path in paths:
+			found, value = get_db_path_value(self.db, path)
+			if found:
+				item = {"path": path, "value": value}
+			else:
+				item = {"path": path, "delete": True}
+			lines.append(json.dumps(item))
+		text = '\n'.join(lines) + '\n'
+		with open(wal_path, 'at') as file:
+			file.write(text)
+		return os.path.getsize(wal_path)
+	#end define
+
+	def get_file_stamp(self, path):
+		try:
+			stat = os.stat(path)
+		except FileNotFoundError:
+			return None
+		return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+	#end define
+
+	def get_db_stamp(self):
+		db_path = self.buffer.db_path
+		return [self.get_file_stamp(db_path), self.get_file_stamp(db_path + ".wal")]
 	#end define
 
 	def merge_three_dicts(self, local_data, file_data, old_file_data):
@@ -554,89 +3158,167 @@ class MyPyClass:
 			print(file_data.keys())
 			raise Exception(f"merge_three_dicts error: merge the same object")
 		#end if
-		
-		need_write_local_data = False
-		if local_data == file_data and file_data == old_file_data:
-			return need_write_local_data
-		#end if
 
-		dict_keys = list()
-		dict_keys += [key for key in local_data if key not in dict_keys]
-		dict_keys += [key for key in file_data if key not in dict_keys]
-		for key in dict_keys:
-			buff = self.merge_three_dicts_process(key, local_data, file_data, old_file_data)
-			if buff is True:
-				need_write_local_data = True
+		diff = self.merge_three_dicts_diff(local_data, file_data, old_file_data)
+		need_write_local_data = len(diff.local) > 0
 		return need_write_local_data
 	#end define
 
-	def merge_three_dicts_process(self, key, local_data, file_data, old_file_data):
-		need_write_local_data = False
-		tmp = self.mtdp_get_tmp(key, local_data, file_data, old_file_data)
-		if tmp.local_item != tmp.file_item and tmp.file_item == tmp.old_file_item:
-			# find local change
-			self.mtdp_flc(key, local_data, file_data, old_file_data)
-			need_write_local_data = True
-		elif tmp.file_item != tmp.old_file_item:
-			# find config file change
-			self.mtdp_fcfc(key, local_data, file_data, old_file_data)
-		return need_write_local_data
+	def merge_three_dicts_diff(self, local_data, file_data, old_file_data):
+		'''
+		Apply the changes of `file_data` relative to `old_file_data` to `local_data`.
+		Return Dict(local=[...], file=[...]) with the paths changed on each side
+		'''
+		local_changes = list()
+		file_changes = list()
+		self.merge_three_dicts_process(local_data, file_data, old_file_data, (), local_changes, file_changes)
+		return Dict(local=local_changes, file=file_changes)
 	#end define
-	
-	def mtdp_get_tmp(self, key, local_data, file_data, old_file_data):
-		tmp = Dict()
-		tmp.local_item = local_data.get(key)
-		tmp.file_item = file_data.get(key)
-		tmp.old_file_item = old_file_data.get(key)
-		tmp.local_item_type = type(tmp.local_item)
-		tmp.file_item_type = type(tmp.file_item)
-		tmp.old_file_item_type = type(tmp.old_file_item)
-		return tmp
-	#end define
-
-	def mtdp_flc(self, key, local_data, file_data, old_file_data):
-		dict_types = [dict, Dict]
-		tmp = self.mtdp_get_tmp(key, local_data, file_data, old_file_data)
-		if tmp.local_item_type in dict_types and tmp.file_item_type in dict_types and tmp.old_file_item_type in dict_types:
-			self.merge_three_dicts(tmp.local_item, tmp.file_item, tmp.old_file_item)
-		elif tmp.local_item is None:
-			#print(f"find local change {key} -> {tmp.local_item}")
-			pass
-		elif tmp.local_item_type not in dict_types:
-			#print(f"find local change {key}: {tmp.old_file_item} -> {tmp.local_item}")
-			pass
-		elif tmp.local_item_type in dict_types:
-			#print(f"find local change {key}: {tmp.old_file_item} -> {tmp.local_item}")
-			pass
-		else:
-			raise Exception(f"mtdp_flc error: {key} -> {tmp.local_item_type}, {tmp.file_item_type}, {tmp.old_file_item_type}")
-	#end define
-
-	def mtdp_fcfc(self, key, local_data, file_data, old_file_data):
-		dict_types = [dict, Dict]
-		tmp = self.mtdp_get_tmp(key, local_data, file_data, old_file_data)
-		if tmp.local_item_type in dict_types and tmp.file_item_type in dict_types and tmp.old_file_item_type in dict_types:
-			self.merge_three_dicts(tmp.local_item, tmp.file_item, tmp.old_file_item)
-		elif tmp.file_item is None:
-			#print(f"find config file change {key} -> {tmp.file_item}")
-			local_data.pop(key)
-		elif tmp.file_item_type not in dict_types:
-			#print(f"find config file change {key}: {tmp.old_file_item} -> {tmp.file_item}")
-			local_data[key] = tmp.file_item
-		elif tmp.file_item_type in dict_types:
-			#print(f"find config file change {key}: {tmp.old_file_item} -> {tmp.file_item}")
-			local_data[key] = Dict(tmp.file_item)
-		else:
-			raise Exception(f"mtdp_fcfc error: {key} -> {tmp.local_item_type}, {tmp.file_item_type}, {tmp.old_file_item_type}")
+
+	def merge_three_dicts_process(self, local_data, file_data, old_file_data, path, local_changes, file_changes):
+		# Read the snapshot content directly, without a view per key
+		state = None
+		old_content = old_file_data
+		if isinstance(old_file_data, DictSnapshot):
+			state = old_file_data._state
+			old_content = state.content(old_file_data._node)
+		#end if
+
+		local_keys = list(dict.keys(local_data))
+		local_keys_set = set(local_keys)
+		keys = local_keys + [key for key in dict.keys(file_data) if key not in local_keys_set]
+		for key in keys:
+			local_item = dict.get(local_data, key, merge_missing)
+			file_item = dict.get(file_data, key, merge_missing)
+			old_item = dict.get(old_content, key, merge_missing)
+			if is_merge_item_equal(file_item, old_item, state):
+				if not is_merge_item_equal(local_item, old_item, state):
+					local_changes.append(path + (key,))
+				continue
+			#end if
+
+			if (isinstance(local_item, dict) and isinstance(file_item, dict) and
+				isinstance(old_item, dict)):
+				if state is not None and isinstance(old_item, TrackedDict):
+					old_item = DictSnapshot(old_item, state)
+				self.merge_three_dicts_process(local_data[key], file_item, old_item, path + (key,),
+					local_changes, file_changes)
+				continue
+			#end if
+
+			file_changes.append(path + (key,))
+			if file_item is merge_missing:
+				local_data.pop(key, None)
+			else:
+				local_data[key] = detach_value(file_item)
 	#end define
 
 	def save_db(self):
-		with self._tlock, self._flock:
-			file_data = self.read_db(self.buffer.db_path)
-			need_write_local_data = self.merge_three_dicts(self.db, file_data, self.buffer.old_db)
-			self.buffer.old_db = Dict(self.db)
-			if need_write_local_data is True:
+		if self.is_db_synced():
+			self.buffer.db_saves_skipped += 1
+			return
+		self.buffer.db_saves_performed += 1
+		if self.db.config.isLocaldbJournal is True:
+			self.save_db_journal()
+		else:
+			self.save_db_full()
+	#end define
+
+	def is_db_synced(self):
+		'''Fast path of save_db: neither the local db nor the db file was changed'''
+		tracker = self.db._tracker
+		if tracker is None or tracker.generation != self.buffer.db_generation:
+			return False
+		if time.time() - self.buffer.db_full_save_time > self.db.config.localdbFullSaveInterval:
+			return False
+		return self.get_db_stamp() == self.buffer.db_stamp
+	#end define
+
+	def get_db_tracker(self):
+		if not isinstance(self.db, TrackedDict):
+			self.db = TrackedDict(self.db)
+		tracker = self.db._tracker
+		if tracker is None:
+			tracker = DictTracker()
+			self.db._track(tracker)
+		return tracker
+	#end define
+
+	def get_db_lock(self):
+		if self._flock is None:
+			self._flock = filelock.FileLock(
+				self.buffer.db_lock_path,
+				is_singleton=True,
+				poll_interval=0.01,
+				timeout=3,
+			)
+		return self._flock
+	#end define
+
+	def save_db_full(self):
+		'''
+		Merge the local db with the db file and write it if needed. Changes are
+		found by the generation stamps of the TrackedDict tree. Every
+		localdbFullSaveInterval seconds the db is also compared with the file
+		value by value, this catches changes that bypass the tracker:
+		dict.__setitem__(db, ...), other objects changed in place and the like
+		'''
+		with self._tlock, self.get_db_lock():
+			tracker = self.get_db_tracker()
+			self.buffer.db_generation = tracker.generation
+			tracker.clear()
+			full_compare = time.time() - self.buffer.db_full_save_time > self.db.config.localdbFullSaveInterval
+			if self.get_db_stamp() != self.buffer.db_stamp:
+				file_data = self.read_db(self.buffer.db_path)
+				need_write_local_data = self.merge_three_dicts(self.db, file_data, self._old_db)
+			elif full_compare:
+				# dict != compares the whole trees, without the generation shortcuts
+				file_data = self.read_db(self.buffer.db_path)
+				need_write_local_data = dict.__ne__(self.db, file_data)
+			else:
+				# Nobody else changed the file, only local changes are possible
+				need_write_local_data = self.db != self._old_db
+			self._old_db = tracker.snapshot(self.db)
+			if need_write_local_data is True or self.need_db_migration():
+				self.write_db(self.db)
+				self.buffer.db_compact_time = time.time()
+			self.buffer.db_stamp = self.get_db_stamp()
+			self.buffer.db_full_save_time = time.time()
+	#end define
+
+	def need_db_migration(self):
+		'''The db file is stored in another format than set in config'''
+		db_format = get_db_format_kind(self.db.config.localdbFormat or "json")
+		return self.buffer.db_file_format != [db_format, self.db.config.localdbCompression]
+	#end define
+
+	def save_db_journal(self):
+		'''
+		Append only the changed paths of the local db to the `.wal` journal.
+		A full merge is done on the first save and when the db file was changed
+		by someone else, the journal is compacted into the db file periodically
+		'''
+		with self._tlock, self.get_db_lock():
+			tracker = self.db._tracker
+			full_save_age = time.time() - self.buffer.db_full_save_time
+			if (tracker is None or self.get_db_stamp() != self.buffer.db_stamp or
+				full_save_age > self.db.config.localdbFullSaveInterval):
+				self.save_db_full()
+				return
+			#end if
+
+			self.buffer.db_generation = tracker.generation
+			self._old_db = tracker.snapshot(self.db)
+			paths = tracker.take()
+			if len(paths) == 0:
+				return
+			wal_size = self.write_db_wal(paths)
+			compact_time = self.buffer.db_compact_time or 0
+			if (wal_size > self.db.config.localdbWalMaxSize or
+				time.time() - compact_time > self.db.config.localdbCompactInterval):
 				self.write_db(self.db)
+				self.buffer.db_compact_time = time.time()
+			self.buffer.db_stamp = self.get_db_stamp()
 	#end define
 	
 	def save(self):
@@ -652,8 +3334,8 @@ class MyPyClass:
 			self.write_db(self.db)
 		try:
 			file_data = self.read_db(db_path)
-			self.db = Dict(file_data)
-			self.buffer.old_db = Dict(file_data)
+			self.db = file_data
+			self._old_db = file_data._snapshot()
 			self.set_default_config()
 			result = True
 		except Exception as err:
@@ -666,7 +3348,7 @@ class MyPyClass:
 			file = open(file_path)
 			text = file.read()
 			file.close()
-			self.db = json.loads(text)
+			self.db = LazyDict(json.loads(text))
 			self.save_db()
 			print("get setting successful: " + file_path)
 			self.exit()
@@ -703,38 +3385,276 @@ class MyPyClass:
 
 	def try_function(self, func, **kwargs):
 		args = kwargs.get("args")
+		stats = kwargs.get("stats")
 		result = None
+		error = False
+		start = time.perf_counter_ns()
 		try:
 			if args is None:
 				result = func()
 			else:
 				result = func(*args)
 		except Exception as err:
+			error = True
 			self.add_log(f"{func.__name__} error: {err}", ERROR)
+		if stats is not None:
+			stats.record(time.perf_counter_ns() - start, error)
 		return result
 	#end define
 
 	def start_thread(self, func, **kwargs):
 		name = kwargs.get("name", func.__name__)
-		args = kwargs.get("args")
-		if args is None:
-			threading.Thread(target=func, name=name, daemon=True).start()
-		else:
-			threading.Thread(target=func, name=name, args=args, daemon=True).start()
+		args = kwargs.get("args") or tuple()
+		stats = self.get_cycle_stats(name)
+		threading.Thread(target=self.thread_function, name=name, args=(func, args, stats), daemon=True).start()
 		self.add_log("Thread {name} started".format(name=name), "debug")
 	#end define
 
+	def thread_function(self, func, args, stats):
+		error = True
+		start = time.perf_counter_ns()
+		try:
+			func(*args)
+			error = False
+		finally:
+			stats.record(time.perf_counter_ns() - start, error)
+	#end define
+
 	def cycle(self, func, sec, args):
+		stats = self.get_cycle_stats(self.get_thread_name())
 		while self.working:
-			self.try_function(func, args=args)
-			time.sleep(sec)
+			self.try_function(func, args=args, stats=stats)
+			self._stop_event.wait(sec)
 	#end define
 
 	def start_cycle(self, func, **kwargs):
+		'''
+		Run `func` every `sec` seconds on the scheduler.
+		mode: "delay" (the period starts after the run) or "rate" (fixed rate);
+		jitter: random extra delay in sec; max_concurrency: parallel runs of the job;
+		reserved: the job may use the workers kept for the built-in cycles
+		'''
+		name = kwargs.get("name", func.__name__)
+		args = kwargs.get("args")
+		sec = kwargs.get("sec")
+		mode = kwargs.get("mode", "delay")
+		jitter = kwargs.get("jitter", 0)
+		max_concurrency = kwargs.get("max_concurrency", 1)
+		reserved = kwargs.get("reserved", False)
+		job = CycleJob(func, name, args, sec, mode, jitter, max_concurrency, self.get_cycle_stats(name), reserved)
+		self._scheduler.max_workers = self.db.config.schedulerMaxWorkers or self._scheduler.max_workers
+		self._scheduler.add_job(job)
+		self.add_log("Cycle {name} started".format(name=name), "debug")
+		return job
+	#end define
+
+	def get_thread_pool(self):
+		with self._pool_lock:
+			if self._thread_pool is None:
+				max_workers = self.db.config.threadPoolSize or None
+				self._thread_pool = concurrent_futures.ThreadPoolExecutor(max_workers=max_workers,
+					thread_name_prefix=f"{self.buffer.my_name}_pool")
+			return self._thread_pool
+	#end define
+
+	def get_process_pool(self):
+		with self._pool_lock:
+			if self._process_pool is None:
+				max_workers = self.db.config.processPoolSize or None
+				self._process_pool = concurrent_futures.ProcessPoolExecutor(max_workers=max_workers)
+			return self._process_pool
+	#end define
+
+	def shutdown_pools(self):
+		with self._pool_lock:
+			for pool in (self._thread_pool, self._process_pool):
+				if pool is not None:
+					pool.shutdown(wait=False, cancel_futures=True)
+			self._thread_pool = None
+			self._process_pool = None
+	#end define
+
+	def submit(self, func, *args, timeout=None, process=False, **kwargs):
+		'''
+		Run `func` on the managed thread pool (or process pool) and return a Future.
+		Errors are logged. A task that runs longer than `timeout` sec is logged
+		'''
+		return self.submit_pool_task(func, args, kwargs, timeout, process).future
+	#end define
+
+	def submit_pool_task(self, func, args, kwargs, timeout, process):
+		pool = self.get_process_pool() if process else self.get_thread_pool()
+		task = PoolTask(getattr(func, "__name__", "task"), timeout, process)
+		if timeout is None:
+			task.future = pool.submit(func, *args, **kwargs)
+		elif process:
+			# A worker process can not report its start, the executor marks the future running
+			# instead when it queues the task to the processes, at most one task early
+			task.future = pool.submit(func, *args, **kwargs)
+			self.poll_pool_task(task)
+		else:
+			task.future = pool.submit(self.run_pool_task, task, func, args, kwargs)
+		task.future.add_done_callback(functools.partial(self.pool_task_done, task))
+		return task
+	#end define
+
+	def run_pool_task(self, task, func, args, kwargs):
+		self.start_pool_task(task)
+		return func(*args, **kwargs)
+	#end define
+
+	def start_pool_task(self, task):
+		task.start_time = time.monotonic()
+		task.timer_job = self._scheduler.call_later(task.timeout, self.pool_task_timeout, args=(task,))
+		task.started.set()
+	#end define
+
+	def poll_pool_task(self, task):
+		if task.future.done():
+			return
+		if task.future.running():
+			self.start_pool_task(task)
+			return
+		task.timer_job = self._scheduler.call_later(min(task.timeout, 0.05), self.poll_pool_task, args=(task,))
+	#end define
+
+	def pool_task_done(self, task, future):
+		task.started.set()
+		if task.timer_job is not None:
+			self._scheduler.cancel(task.timer_job)
+		if future.cancelled():
+			return
+		err = future.exception()
+		if err is not None:
+			self.add_log(f"{task.name} error: {err}", ERROR)
+	#end define
+
+	def pool_task_timeout(self, task):
+		future = task.future
+		if future is not None and future.done():
+			return
+		self.add_log(f"{task.name} error: timeout {task.timeout} sec", ERROR)
+	#end define
+
+	def get_pool_task_result(self, task):
+		'''Result of the task, waits at most `timeout` sec from the start of the task'''
+		if task.timeout is None:
+			return task.future.result()
+		task.started.wait()
+		wait = 0
+		if task.start_time is not None:
+			wait = max(0, task.start_time + task.timeout - time.monotonic())
+		return task.future.result(wait)
+	#end define
+
+	def map(self, func, iterable, timeout=None, process=False):
+		'''
+		Run `func` for each item on the managed pool and return the results in order.
+		`timeout` applies to each task from its start, a failed or timed out task gives None
+		'''
+		tasks = [self.submit_pool_task(func, (item,), {}, timeout, process) for item in iterable]
+		result = list()
+		for task in tasks:
+			try:
+				result.append(self.get_pool_task_result(task))
+			except Exception:
+				result.append(None)  # logged by pool_task_done or pool_task_timeout
+		return result
+	#end define
+
+	def run_loop(self, main=None, *args):
+		'''Run the service and the coroutine function `main` on an asyncio event loop in this thread'''
+		asyncio.run(self.async_run(main, *args))
+	#end define
+
+	async def async_run(self, main=None, *args):
+		self._loop = asyncio.get_running_loop()
+		self._loop_thread_id = threading.get_ident()
+		self._async_stop = asyncio.Event()
+		for signum in (signal.SIGINT, signal.SIGTERM):
+			try:
+				self._loop.add_signal_handler(signum, self.async_exit)
+			except (NotImplementedError, RuntimeError):
+				pass  # not the main thread or not supported by the platform
+		self.run()
+		if main is not None:
+			self.start_task(main(*args), name=main.__name__)
+		await self._async_stop.wait()
+
+		# Graceful shutdown
+		for task in list(self._tasks):
+			task.cancel()
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+		await self._loop.run_in_executor(None, self.shutdown)
+		self._loop = None
+	#end define
+
+	def async_exit(self):
+		self.working = False
+		self._stop_event.set()
+		self._async_stop.set()
+	#end define
+
+	def start_task(self, coro, name=None):
+		'''Schedule the coroutine on the service event loop, can be called from any thread'''
+		loop = self._loop
+		if loop is None:
+			coro.close()
+			raise Exception("start_task error: the event loop is not running")
+		if threading.get_ident() != self._loop_thread_id:
+			return asyncio.run_coroutine_threadsafe(coro, loop)
+		task = loop.create_task(coro, name=name)
+		self._tasks.add(task)
+		task.add_done_callback(self.task_done)
+		return task
+	#end define
+
+	def task_done(self, task):
+		self._tasks.discard(task)
+		if task.cancelled():
+			return
+		err = task.exception()
+		if err is not None:
+			self.add_log(f"{task.get_name()} error: {err}", ERROR)
+	#end define
+
+	async def async_try_function(self, func, **kwargs):
+		'''Await a coroutine function, or run a blocking function in an executor'''
+		args = kwargs.get("args") or tuple()
+		stats = kwargs.get("stats")
+		result = None
+		error = False
+		start = time.perf_counter_ns()
+		try:
+			if asyncio.iscoroutinefunction(func):
+				result = await func(*args)
+			else:
+				result = await self._loop.run_in_executor(self.get_thread_pool(), functools.partial(func, *args))
+		except Exception as err:
+			error = True
+			self.add_log(f"{func.__name__} error: {err}", ERROR)
+		if stats is not None:
+			stats.record(time.perf_counter_ns() - start, error)
+		return result
+	#end define
+
+	async def async_cycle(self, func, sec, args, stats=None):
+		while self.working:
+			await self.async_try_function(func, args=args, stats=stats)
+			try:
+				await asyncio.wait_for(self._async_stop.wait(), sec)
+			except asyncio.TimeoutError:
+				pass
+	#end define
+
+	def start_async_cycle(self, func, **kwargs):
+		'''Run `func` (coroutine function or blocking function) every `sec` seconds on the event loop'''
 		name = kwargs.get("name", func.__name__)
 		args = kwargs.get("args")
 		sec = kwargs.get("sec")
-		self.start_thread(self.cycle, name=name, args=(func, sec, args))
+		task = self.start_task(self.async_cycle(func, sec, args, self.get_cycle_stats(name)), name=name)
+		self.add_log("Async cycle {name} started".format(name=name), "debug")
+		return task
 	#end define
 
 	def init_translator(self, file_path=None):
@@ -760,14 +3680,301 @@ class MyPyClass:
 	#end define
 #end class
 
+db_container_magic = b"MPDB\x01"
+db_container_formats = {1: "json", 2: "msgpack"}
+db_container_compressions = {0: None, 1: "zlib", 2: "zstd"}
+
+def get_db_format_kind(db_format):
+	'''json, json-compact, orjson and ujson are all stored as JSON text'''
+	if db_format == "msgpack":
+		return "msgpack"
+	return "json"
+#end define
+
+def encode_db_data(data, db_format="json", compression=None):
+	if db_format == "json":
+		payload = json.dumps(data, indent=4).encode("utf-8")
+	elif db_format == "json-compact":
+		payload = json.dumps(data, separators=(',', ':')).encode("utf-8")
+	elif db_format == "orjson":
+		orjson = import_optional("orjson")
+		if orjson is None:
+			raise Exception("encode_db_data error: orjson is not installed")
+		# orjson writes NaN and Infinity as null and has no integers beyond 64 bits
+		try:
+			payload = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+		except TypeError:
+			payload = json.dumps(data, separators=(',', ':')).encode("utf-8")
+	elif db_format == "ujson":
+		ujson = import_optional("ujson")
+		if ujson is None:
+			raise Exception("encode_db_data error: ujson is not installed")
+		payload = ujson.dumps(data, ensure_ascii=False).encode("utf-8")
+	elif db_format == "msgpack":
+		msgpack = import_optional("msgpack")
+		if msgpack is None:
+			raise Exception("encode_db_data error: msgpack is not installed")
+		payload = msgpack.packb(data, use_bin_type=True)
+	else:
+		raise Exception(f"encode_db_data error: unknown format {db_format}")
+	kind = get_db_format_kind(db_format)
+	if kind == "json" and compression is None:
+		return payload
+
+	# Binary container: magic, format id, compression id, payload
+	if compression == "zlib":
+		payload = zlib.compress(payload)
+	elif compression == "zstd":
+		zstandard = import_optional("zstandard")
+		if zstandard is None:
+			raise Exception("encode_db_data error: zstandard is not installed")
+		payload = zstandard.ZstdCompressor().compress(payload)
+	elif compression is not None:
+		raise Exception(f"encode_db_data error: unknown compression {compression}")
+	format_id = next(key for key, value in db_container_formats.items() if value == kind)
+	compression_id = next(key for key, value in db_container_compressions.items() if value == compression)
+	return db_container_magic + bytes([format_id, compression_id]) + payload
+#end define
+
+def decode_db_data(raw, fast=False):
+	'''Return data, format kind and compression of an encoded db file, see load_json for `fast`'''
+	if not raw.startswith(db_container_magic):
+		return load_json(raw, fast), "json", None
+	header_size = len(db_container_magic) + 2
+	kind = db_container_formats[raw[header_size - 2]]
+	compression = db_container_compressions[raw[header_size - 1]]
+	payload = raw[header_size:]
+	if compression == "zlib":
+		payload = zlib.decompress(payload)
+	elif compression == "zstd":
+		zstandard = import_optional("zstandard")
+		if zstandard is None:
+			raise Exception("decode_db_data error: zstandard is not installed")
+		payload = zstandard.ZstdDecompressor().decompress(payload)
+	if kind == "msgpack":
+		msgpack = import_optional("msgpack")
+		if msgpack is None:
+			raise Exception("decode_db_data error: msgpack is not installed")
+		data = msgpack.unpackb(payload, raw=False, strict_map_key=False)
+	else:
+		data = load_json(payload, fast)
+	return data, kind, compression
+#end define
+
+long_number_pattern = re.compile(rb"\d{19}")
+
+def load_json(raw, fast=False):
+	'''
+	json.loads. With `fast` orjson is tried first, for files written by the
+	orjson backend. orjson rejects NaN and Infinity and turns integers
+	beyond 64 bits into floats, such input is left to json
+	'''
+	orjson = import_optional("orjson") if fast else None
+	if orjson is not None and not long_number_pattern.search(raw):
+		try:
+			return orjson.loads(raw)
+		except orjson.JSONDecodeError:
+			pass
+	return json.loads(raw)
+#end define
+
+merge_missing = object()
+
+def is_merge_item_equal(item, old_item, state):
+	'''Compare an item with the merge base, unchanged snapshot subtrees are compared by identity'''
+	if item is merge_missing or old_item is merge_missing:
+		return item is old_item
+	if state is None or not isinstance(old_item, (TrackedDict, TrackedList)):
+		return item is old_item or item == old_item
+	if old_item._gen <= state.generation:
+		return item is old_item or item == old_item
+	return item == state.view(old_item)
+#end define
+
+def get_db_path_value(data, path):
+	node = data
+	for key in path:
+		if not isinstance(node, dict) or key not in node:
+			return False, None
+		node = node[key]
+	return True, node
+#end define
+
+def apply_db_wal_item(data, item):
+	path = item["path"]
+	node = data
+	for key in path[:-1]:
+		if not isinstance(node.get(key), dict):
+			node[key] = dict()
+		node = node[key]
+	if "value" in item:
+		node[path[-1]] = item["value"]
+	else:
+		node.pop(path[-1], None)
+#end define
+
+def try_call(obj, name):
+	'''Call a psutil getter that is not available on every platform'''
+	try:
+		return getattr(obj, name)()
+	except (AttributeError, NotImplementedError, psutil.AccessDenied):
+		return None
+#end define
+
+def add_metric(lines, name, type, help, samples):
+	'''Append an OpenMetrics family, samples are (suffix, labels, value), None values are skipped'''
+	samples = [sample for sample in samples if sample[2] is not None]
+	if len(samples) == 0:
+		return
+	name = "mypylib_" + name
+	lines.append(f"# TYPE {name} {type}")
+	lines.append(f"# HELP {name} {help}")
+	for suffix, labels, value in samples:
+		text = ""
+		if labels:
+			text = ','.join(f'{key}="{escape_metric_label(item)}"' for key, item in labels.items())
+			text = '{' + text + '}'
+		lines.append(f"{name}{suffix}{text} {value}")
+#end define
+
+def escape_metric_label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+#end define
+
+def get_histogram_bucket_max(index):
+	'''Largest value that falls into the CycleStats histogram bucket'''
+	if index < 4:
+		return index
+	shift = (index >> 2) - 1
+	return (((index & 3) + 5) << shift) - 1
+#end define
+
 def get_hash_md5(file_name):
-	blocksize = 65536
-	hasher = hashlib.md5()
+	return get_file_hash(file_name, "md5")
+#end define
+
+def iter_json_parts(item):
+	'''
+	Text of json.dumps(item) in parts: the top level entries of a dict or list
+	are encoded one by one with the C encoder (json.JSONEncoder.iterencode
+	yields single tokens and is several times slower)
+	'''
+	if isinstance(item, dict) and all(isinstance(key, str) for key in item):
+		yield '{'
+		separator = ""
+		for key, value in item.items():
+			yield f"{separator}{json.dumps(key)}: {json.dumps(value)}"
+			separator = ", "
+		yield '}'
+	elif isinstance(item, (list, tuple)):
+		yield '['
+		separator = ""
+		for value in item:
+			yield separator + json.dumps(value)
+			separator = ", "
+		yield ']'
+	else:
+		yield json.dumps(item)
+#end define
+
+log_time_pattern = re.compile(rb"(\d\d)\.(\d\d)\.(\d{4}), (\d\d):(\d\d):(\d\d)\.(\d{3}) \(UTC\)")
+log_json_time_pattern = re.compile(rb'\{"ts": ?(\d+)')
+
+def get_log_line_time(line):
+	'''Timestamp of a line written by add_log (text or json), None for other lines'''
+	match = log_json_time_pattern.match(line)
+	if match is not None:
+		return int(match.group(1)) / 10**9
+	match = log_time_pattern.search(line, 0, 96)
+	if match is None:
+		return None
+	day, month, year, hour, minute, second, msec = map(int, match.groups())
+	result = date_time_library.datetime(year, month, day, hour, minute, second, msec * 1000, date_time_library.timezone.utc)
+	return result.timestamp()
+#end define
+
+def find_log_line_time(buf, offset):
+	'''return (time, offset) of the first complete line with time at or after `offset`'''
+	if offset > 0 and buf[offset - 1] != 10:  # b'\n'
+		offset = buf.find(b'\n', offset) + 1
+		if offset == 0:
+			return None, None
+	while True:
+		newline = buf.find(b'\n', offset)
+		if newline < 0:
+			return None, None
+		time = get_log_line_time(buf[offset:min(newline, offset + 128)])
+		if time is not None:
+			return time, offset
+		offset = newline + 1
+#end define
+
+def map_file(file):
+	'''Read only mmap of an open binary file, None for an empty file'''
+	if os.fstat(file.fileno()).st_size == 0:
+		return None
+	return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+#end define
+
+def count_file_lines(path, chunk_size=1 << 24):
+	if not os.path.isfile(path):
+		return 0
+	with open(path, 'rb') as file:
+		buf = map_file(file)
+		if buf is None:
+			return 0
+		with buf:
+			return sum(buf[i:i + chunk_size].count(b'\n') for i in range(0, len(buf), chunk_size))
+#end define
+
+def thr_wait(event, sec):
+	if event is None:
+		time.sleep(sec)
+	else:
+		event.wait(sec)
+#end define
+
+def write_file_atomic(path, text=""):
+	'''Write through a temporary file and rename, readers never see a partial file'''
+	dir = os.path.dirname(path)
+	name = os.path.basename(path)
+	fd, tmp = tempfile.mkstemp(dir=dir, prefix=f".{name}.")
+	try:
+		with os.fdopen(fd, "wb" if isinstance(text, bytes) else "wt") as file:
+			file.write(text)
+		os.replace(tmp, path)
+	except:
+		try:
+			os.remove(tmp)
+		except OSError:
+			pass
+		raise
+#end define
+
+def get_hasher(algorithm):
+	'''hashlib algorithm (md5, sha256, blake2b, ...) or xxh64/xxh3_64/xxh128 when xxhash is installed'''
+	if algorithm.startswith("xxh"):
+		xxhash = import_optional("xxhash")
+		if xxhash is None:
+			raise Exception("get_hasher error: xxhash is not installed")
+		return getattr(xxhash, algorithm)()
+	return hashlib.new(algorithm)
+#end define
+
+def get_file_hash(file_name, algorithm="md5"):
+	'''Hex digest of a file, large files are hashed through mmap without copying'''
+	blocksize = 1048576
+	hasher = get_hasher(algorithm)
 	with open(file_name, 'rb') as file:
-		buf = file.read(blocksize)
-		while len(buf) > 0:
-			hasher.update(buf)
+		size = os.fstat(file.fileno()).st_size
+		if size > blocksize:
+			with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+				hasher.update(buf)
+		else:
 			buf = file.read(blocksize)
+			while len(buf) > 0:
+				hasher.update(buf)
+				buf = file.read(blocksize)
 	return hasher.hexdigest()
 #end define
 
@@ -791,11 +3998,80 @@ def ping(hostname):
 	return result
 #end define
 
-def get_request(url):
-	link = urlopen(url)
-	data = link.read()
-	text = data.decode("utf-8")
-	return text
+def get_request(url, timeout=None, cache_ttl=None):
+	if urllib_parse.urlsplit(url).scheme not in ("http", "https"):
+		# file:, ftp:, data: and the like, as before HttpClient
+		with urllib_request.urlopen(url, timeout=timeout or get_http_client().timeout) as link:
+			return link.read().decode("utf-8")
+	response = get_http_client().get(url, timeout=timeout, cache_ttl=cache_ttl)
+	if response.status >= 400:
+		raise Exception(f"get_request error: {response.status} {response.reason}")
+	return response.text
+#end define
+
+http_client_lock = threading.Lock()
+http_client_default = None
+
+def get_http_client():
+	'''Shared HttpClient of the library'''
+	global http_client_default
+	with http_client_lock:
+		if http_client_default is None:
+			http_client_default = HttpClient()
+		return http_client_default
+#end define
+
+def get_proxy_headers(proxy):
+	'''Proxy-Authorization header for the credentials in a proxy URL'''
+	parts = urllib_parse.urlsplit(proxy)
+	if parts.username is None:
+		return dict()
+	credentials = f"{urllib_parse.unquote(parts.username)}:{urllib_parse.unquote(parts.password or '')}"
+	return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")}
+#end define
+
+@functools.lru_cache(maxsize=None)
+def get_family_connection_class(scheme):
+	'''
+	http.client connection class that connects to the host over one address
+	family, set in its `family` attribute. Made on first use, so that
+	http.client stays a lazy import
+	'''
+	if scheme == "https":
+		# HTTPSConnection.connect() wraps the socket made by FamilyHTTPConnection.connect()
+		class FamilyHTTPSConnection(http_client.HTTPSConnection, get_family_connection_class("http")):
+			pass
+		#end class
+		return FamilyHTTPSConnection
+
+	class FamilyHTTPConnection(http_client.HTTPConnection):
+		family = socket.AF_UNSPEC
+
+		def connect(self):
+			self.sock = create_connection_family(self.family, (self.host, self.port), self.timeout, self.source_address)
+			self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		#end define
+	#end class
+	return FamilyHTTPConnection
+#end define
+
+def create_connection_family(family, address, timeout=None, source_address=None):
+	'''socket.create_connection limited to one address family'''
+	host, port = address
+	err = None
+	for af, socktype, proto, canonname, sa in socket.getaddrinfo(host, port, family, socket.SOCK_STREAM):
+		sock = socket.socket(af, socktype, proto)
+		try:
+			if timeout is not None:
+				sock.settimeout(timeout)
+			if source_address:
+				sock.bind(source_address)
+			sock.connect(sa)
+			return sock
+		except OSError as error:
+			err = error
+			sock.close()
+	raise err or OSError(f"getaddrinfo returns an empty list for {host}")
 #end define
 
 def dir(input_dir):
@@ -808,6 +4084,20 @@ def b2mb(item):
 	return round(int(item) / 1000 / 1000, 2)
 #end define
 
+def find_in_names(paths_by_name, pattern, regex):
+	if pattern is None:
+		names = paths_by_name.keys()
+	elif any(char in pattern for char in "*?["):
+		names = [name for name in paths_by_name if fnmatch.fnmatchcase(name, pattern)]
+	else:
+		names = [pattern] if pattern in paths_by_name else list()
+	result = [path for name in names for path in paths_by_name[name]]
+	if regex is not None:
+		regex = re.compile(regex)
+		result = [path for path in result if regex.search(path)]
+	return result
+#end define
+
 def search_file_in_dir(path, file_name):
 	result = None
 	for entry in os.scandir(path):
@@ -1272,13 +4562,17 @@ def write_config_to_file(config_path:str, data:dict):
 	file.close()
 #end define
 
-def get_own_ip():
+def get_own_ip(urls=("https://ifconfig.me/ip", "https://ipinfo.io/ip"), cache_ttl=600):
+	'''Public IPv4 address, asked over IPv4 and cached for `cache_ttl` sec'''
 	pat = re.compile(r"^((25[0-5]|(2[0-4]|1\d|[1-9]|)\d)(\.(?!$)|$)){4}$")
-	requests.packages.urllib3.util.connection.HAS_IPV6 = False
-	ip = requests.get("https://ifconfig.me/ip").text
-	if not pat.fullmatch(ip):
-		ip = requests.get("https://ipinfo.io/ip").text
-		if not pat.fullmatch(ip):
-			raise Exception('Cannot get own IP address')
-	return ip
+	client = get_http_client()
+	for url in urls:
+		try:
+			response = client.get(url, cache_ttl=cache_ttl, family=socket.AF_INET)
+		except Exception:
+			continue
+		ip = response.text.strip()
+		if response.status == 200 and pat.fullmatch(ip):
+			return ip
+	raise Exception('Cannot get own IP address')
 #end define
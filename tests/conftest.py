@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mypylib
+
+
+@pytest.fixture
+def make_local(tmp_path, monkeypatch):
+	'''Factory of MyPyClass instances that keep their files in tmp_path'''
+	monkeypatch.setattr(mypylib.MyPyClass, "check_root_permission", lambda self: False)
+	monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+	instances = list()
+
+	def make(name="app"):
+		local = mypylib.MyPyClass(str(tmp_path / f"{name}.py"))
+		instances.append(local)
+		return local
+
+	yield make
+	for local in instances:
+		local.shutdown()
@@ -0,0 +1,63 @@
+import base64
+import io
+import json
+import zlib
+
+import pytest
+
+from mypylib import DataCodec, import_optional
+
+item = {"name": "кошелёк", "balance": 10**12, "rate": 0.5, "ok": True, "none": None,
+	"history": [{"seqno": i, "hash": f"{i:064x}"} for i in range(2000)]}
+
+algorithms = [("zlib", None), ("zlib", 1), ("zlib", 9), ("lzma", None), (None, None)]
+if import_optional("zstandard") is not None:
+	algorithms.append(("zstd", None))
+
+
+@pytest.mark.parametrize("base64_mode", [True, False])
+@pytest.mark.parametrize("algorithm, level", algorithms)
+def test_round_trip(algorithm, level, base64_mode):
+	codec = DataCodec(algorithm, level, base64=base64_mode)
+	data = codec.encode(item)
+	assert isinstance(data, str if base64_mode else bytes)
+	assert codec.decode(data) == item
+	# The algorithm is found from the stream, any settings read it
+	assert DataCodec("lzma", base64=base64_mode).decode(data) == item
+	file = io.BytesIO()
+	codec.encode_stream(item, file)
+	file.seek(0)
+	assert codec.decode_stream(file) == item
+
+
+def test_decode_baseline_output(make_local):
+	local = make_local()
+	data = base64.b64encode(zlib.compress(json.dumps(item).encode("utf-8"))).decode("utf-8")
+	assert DataCodec().decode(data) == item
+	assert local.base64_to_dict_with_decompress(data) == item
+	# and the other way round, the baseline decoder reads the default output
+	data = local.dict_to_base64_with_compress(item)
+	assert json.loads(zlib.decompress(base64.b64decode(data))) == item
+
+
+@pytest.mark.parametrize("base64_mode", [True, False])
+@pytest.mark.parametrize("value", [80, 8, 800, 8.5, -1, [1, 2], {"a": 1}, "text", True, None, ["x"]])
+def test_uncompressed_json_is_not_taken_for_zlib(value, base64_mode):
+	codec = DataCodec(None, base64=base64_mode)
+	assert codec.decode(codec.encode(value)) == value
+
+
+def test_zlib_dictionary():
+	samples = [{"address": f"{i:032x}", "status": "active", "seqno": i} for i in range(50)]
+	codec = DataCodec(base64=False)
+	codec.train_dictionary(samples)
+	data = codec.encode(samples[0])
+	assert len(data) < len(DataCodec(base64=False).encode(samples[0]))
+	assert codec.decode(data) == samples[0]
+	with pytest.raises(Exception, match="needs a zlib dictionary"):
+		DataCodec(base64=False).decode(data)
+
+
+def test_unknown_algorithm():
+	with pytest.raises(Exception, match="unknown algorithm"):
+		DataCodec("brotli")
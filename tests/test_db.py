@@ -0,0 +1,110 @@
+import json
+import math
+import os
+import threading
+
+import pytest
+
+from mypylib import import_optional, lazy_wrap_lock
+
+
+def test_instances_share_the_db_file(make_local):
+	first = make_local()
+	second = make_local()
+	first.db.x = 1
+	first.save_db()
+	second.save_db()
+	assert second.db.x == 1
+	second.db.y = 2
+	second.save_db()
+	first.save_db()
+	assert first.db.x == 1
+	assert first.db.y == 2
+
+
+def test_concurrent_changes_are_merged(make_local):
+	first = make_local()
+	second = make_local()
+	first.save_db()
+	second.save_db()
+	first.db.a = 1
+	second.db.b = 2
+	first.save_db()
+	second.save_db()
+	first.save_db()
+	assert (first.db.a, first.db.b) == (1, 2)
+	assert (second.db.a, second.db.b) == (1, 2)
+
+
+def test_wal_replay(make_local):
+	local = make_local()
+	local.db.config.isLocaldbJournal = True
+	local.save_db()
+	local.db.z = 3
+	local.save_db()
+	wal_path = local.buffer.db_path + ".wal"
+	assert os.path.isfile(wal_path)
+	with open(local.buffer.db_path) as file:
+		assert "z" not in json.load(file)
+	with open(wal_path, 'a') as file:
+		file.write('{"path": ["torn"], "val')
+	assert local.read_db(local.buffer.db_path).z == 3
+	assert make_local().db.z == 3
+
+
+def test_wal_of_an_older_db_file_is_ignored(make_local):
+	local = make_local()
+	local.db.config.isLocaldbJournal = True
+	local.save_db()
+	local.db.z = 3
+	local.save_db()
+	data = json.loads(local.read_file(local.buffer.db_path))
+	local.write_file(local.buffer.db_path, json.dumps(data))
+	assert local.read_db(local.buffer.db_path).z is None
+
+
+def test_full_save_finds_untracked_changes(make_local):
+	local = make_local()
+	local.db.lst = [[1, 2]]
+	local.save_db()
+	local.db.lst[0].append(3)
+	local.buffer.db_full_save_time = 0
+	local.save_db()
+	assert local.read_db(local.buffer.db_path).lst == [[1, 2, 3]]
+
+
+@pytest.mark.parametrize("db_format", ["json", "orjson"])
+def test_nan_and_big_int_round_trip(make_local, db_format):
+	if db_format == "orjson" and import_optional("orjson") is None:
+		pytest.skip("orjson is not installed")
+	local = make_local()
+	local.db.config.localdbFormat = db_format
+	local.db.big = 2**70
+	local.db.negative = -2**63 - 1
+	local.db.nan = float("nan")
+	local.db.inf = float("inf")
+	local.save_db()
+	data = make_local().db
+	assert data.big == 2**70
+	assert data.negative == -2**63 - 1
+	assert math.isnan(data.nan)
+	assert data.inf == float("inf")
+	assert data.config.localdbFormat == db_format
+
+
+def test_shutdown_inside_a_db_write(make_local):
+	# exit() runs from a signal handler, which may interrupt the main thread inside these locks
+	local = make_local()
+	local.save_db()
+	local.db.x = 1
+	tracker = local.db._tracker
+
+	def interrupted():
+		with tracker.lock, lazy_wrap_lock:
+			local.shutdown()
+
+	thread = threading.Thread(target=interrupted, daemon=True)
+	thread.start()
+	thread.join(5)
+	assert not thread.is_alive()
+	assert json.loads(open(local.buffer.db_path).read())["x"] == 1
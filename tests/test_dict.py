@@ -0,0 +1,97 @@
+from mypylib import Dict, DictTracker, TrackedDict
+
+
+def make_tracked(**kwargs):
+	db = TrackedDict(**kwargs)
+	tracker = DictTracker()
+	db._track(tracker)
+	return db, tracker
+
+
+def test_nested_write_is_tracked():
+	db, tracker = make_tracked(a={"b": {"c": 1}})
+	db.a.b.c = 2
+	assert tracker.take() == [("a", "b", "c")]
+
+
+def test_moved_subtree_stays_tracked():
+	db, tracker = make_tracked(a={"x": 1})
+	db.b = db.a
+	del db["a"]
+	tracker.take()
+	db.b.x = 2
+	assert tracker.take() == [("b", "x")]
+	assert db == {"b": {"x": 2}}
+
+
+def test_subtree_of_another_tree_is_copied():
+	buffer = Dict(stats={"n": 0})
+	db, tracker = make_tracked()
+	db.stats = buffer.stats
+	tracker.take()
+	db.stats.n = 5
+	assert tracker.take() == [("stats", "n")]
+	assert buffer.stats.n == 0
+	buffer.stats.n = 7
+	assert tracker.take() == []
+
+
+def test_release_keeps_the_parent_of_a_moved_subtree():
+	db, tracker = make_tracked(a={"x": 1})
+	subtree = db.a
+	db.pop("a")
+	db.c = subtree
+	db.a = 5
+	tracker.take()
+	db.c.x = 3
+	assert tracker.take() == [("c", "x")]
+
+
+def test_list_item_added_twice_is_copied():
+	db, tracker = make_tracked(rows=[{"k": 1}])
+	db.rows.append(db.rows[0])
+	tracker.take()
+	db.rows[1].k = 2
+	assert tracker.take() == [("rows",)]
+	assert db.rows == [{"k": 1}, {"k": 2}]
+
+
+def test_dict_keeps_stored_values():
+	item = Dict(a={"b": [1, {"c": 2}]})
+	item.a.b[1].c = 3
+	assert item == {"a": {"b": [1, {"c": 3}]}}
+	plain = {}
+	values = []
+	item.x = plain
+	item.y = values
+	plain["k"] = 1
+	values.append(1)
+	assert item.x is plain and item.y is values
+	assert type(item.a) is Dict
+
+
+def test_dict_stores_a_tracked_subtree_by_reference():
+	db, tracker = make_tracked(config={"n": 0})
+	buffer = Dict()
+	buffer.cfg = db.config
+	buffer.cfg.n = 1
+	assert buffer.cfg is db.config
+	assert tracker.take() == [("config", "n")]
+
+
+def test_list_inside_list_is_tracked():
+	db, tracker = make_tracked(rows=[[1], [2]])
+	snapshot = tracker.snapshot(db)
+	db.rows[0].append(3)
+	assert tracker.take() == [("rows",)]
+	assert db.rows == [[1, 3], [2]]
+	assert snapshot.rows == [[1], [2]]
+
+
+def test_snapshot_keeps_old_content():
+	db, tracker = make_tracked(a={"x": 1}, b={"y": 1})
+	snapshot = tracker.snapshot(db)
+	db.a.x = 2
+	assert snapshot.a.x == 1
+	assert snapshot.b == db.b
+	assert snapshot != db
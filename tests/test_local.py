@@ -0,0 +1,14 @@
+def test_refresh_recomputes_the_paths(make_local, tmp_path, monkeypatch):
+	local = make_local()
+	file = local.file
+	assert local.buffer.my_work_dir == f"{tmp_path}/app/"
+	monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "other"))
+	local.file = str(tmp_path / "renamed.py")
+	local.refresh()
+	assert local.buffer.my_path == f"{tmp_path}/renamed.py"
+	assert local.buffer.my_work_dir == f"{tmp_path}/other/renamed/"
+	assert local.buffer.db_path == f"{tmp_path}/other/renamed/renamed.db"
+	monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+	local.file = file
+	local.refresh()
+	assert local.buffer.db_path == f"{tmp_path}/app/app.db"
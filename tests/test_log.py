@@ -0,0 +1,73 @@
+import os
+import threading
+
+from mypylib import DEBUG, INFO
+
+
+def shutdown_inside(local, *locks):
+	'''exit() runs from a signal handler, which may interrupt the main thread inside these locks'''
+	def interrupted():
+		for lock in locks:
+			lock.acquire()
+		local.shutdown()
+		for lock in locks:
+			lock.release()
+
+	thread = threading.Thread(target=interrupted, daemon=True)
+	thread.start()
+	thread.join(5)
+	return not thread.is_alive()
+
+
+def test_shutdown_inside_a_log_flush(make_local):
+	local = make_local()
+	local.add_log("before shutdown")
+	assert shutdown_inside(local, local._log_sink.lock)
+	with open(local.buffer.log_file_name) as file:
+		assert "before shutdown" in file.read()
+
+
+def test_shutdown_inside_a_log_rotation(make_local):
+	local = make_local()
+	local.db.config.logFileSizeLines = 1
+	local.add_log("first")
+	local.add_log("second")
+	assert shutdown_inside(local, local._log_sink.lock, local._log_rotator.lock)
+	assert os.path.isfile(local.buffer.log_file_name + ".1") or os.path.isfile(local.buffer.log_file_name + ".1.gz")
+
+
+def get_records(local, monkeypatch):
+	records = list()
+	monkeypatch.setattr(local._log_sink, "put", lambda record, urgent=False: records.append(record))
+	return records
+
+
+def test_callable_is_logged_as_is(make_local, monkeypatch):
+	local = make_local()
+	records = get_records(local, monkeypatch)
+	calls = list()
+
+	def func():
+		calls.append(1)
+		return "called"
+
+	local.add_log(func)
+	assert calls == []
+	assert records[0][3] == str(func)
+
+
+def test_lazy_text_is_built_only_when_logged(make_local, monkeypatch):
+	local = make_local()
+	local.set_log_level(INFO)
+	records = get_records(local, monkeypatch)
+	calls = list()
+
+	def func():
+		calls.append(1)
+		return "expensive %s"
+
+	local.add_log(func, DEBUG, 1, lazy=True)
+	assert calls == []
+	local.add_log(func, INFO, 1, lazy=True)
+	assert calls == [1]
+	assert records[0][3] == "expensive 1"
@@ -0,0 +1,77 @@
+import datetime
+import json
+import os
+import time
+
+import pytest
+
+from mypylib import LogFile
+
+
+def write_lines(local, count):
+	text = ''.join(f"18.10.2026, 12:00:00.000 (UTC)  line {i}\n" for i in range(count))
+	local._log_rotator.write(local.buffer.log_file_name, text)
+
+
+def test_log_file_missing_after_rotation(make_local):
+	local = make_local()
+	local.db.config.logFileSizeLines = 100
+	write_lines(local, 352)
+	log = local.get_log_file()
+	assert not os.path.exists(log.path)
+	assert os.path.exists(log.path + ".1") or os.path.exists(log.path + ".1.gz")
+	assert log.count_lines() == 0
+	assert log.tail() == []
+	assert list(log.query()) == []
+	write_lines(local, 3)
+	assert log.tail(2) == ["18.10.2026, 12:00:00.000 (UTC)  line 1", "18.10.2026, 12:00:00.000 (UTC)  line 2"]
+
+
+def format_text(created, text):
+	line_time = time.strftime("%d.%m.%Y, %H:%M:%S.000 (UTC)", time.gmtime(created))
+	return f"\033[34m[info]    \033[0m{line_time}  <MainThread>  {text}"
+
+
+def format_json(created, text):
+	return json.dumps({"ts": int(created * 10**9), "level": "info", "thread": "MainThread", "msg": text})
+
+
+@pytest.mark.parametrize("log_format", ["text", "json"])
+def test_tail_and_query_of_the_service_log(make_local, log_format):
+	local = make_local()
+	local.db.config.logFormat = log_format
+	start = time.time() - 1
+	local.add_log("first")
+	local.add_log("second\ncontinued")
+	local.write_log()
+	log = local.get_log_file()
+	lines = list(log.query(start))
+	if log_format == "json":
+		assert [json.loads(line)["msg"] for line in log.tail(2)] == ["first", "second\ncontinued"]
+		assert [json.loads(line)["msg"] for line in lines][-2:] == ["first", "second\ncontinued"]
+	else:
+		tail = log.tail(3)
+		assert tail[0].endswith("first") and tail[1].endswith("second") and tail[2] == "continued"
+		assert lines[-3:] == tail
+	assert log.count_lines() >= len(lines)
+
+
+@pytest.mark.parametrize("format_line", [format_text, format_json])
+def test_query_time_range(tmp_path, format_line):
+	path = str(tmp_path / "app.log")
+	start = 1760000000
+	with open(path, 'wt') as file:
+		for i in range(10):
+			file.write(format_line(start + i * 60, f"record {i}") + '\n')
+			file.write(f"  detail {i}\n")
+	log = LogFile(path, index_step=64)
+	lines = list(log.query(start + 3 * 60, start + 6 * 60))
+	assert len(lines) == 6
+	assert "record 3" in lines[0] and lines[1] == "  detail 3"
+	assert "record 5" in lines[4] and lines[5] == "  detail 5"
+	begin = datetime.datetime.fromtimestamp(start + 8 * 60, datetime.timezone.utc)
+	assert len(list(log.query(begin))) == 4
+	assert log.tail(1) == ["  detail 9"]
+	with open(path, 'at') as file:
+		file.write(format_line(start + 10 * 60, "record 10") + '\n')
+	assert len(list(log.query(begin))) == 5
@@ -0,0 +1,74 @@
+import re
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from mypylib import escape_metric_label, get_histogram_bucket_max
+
+
+def parse_samples(text):
+	'''{"name{labels}": value} of the sample lines'''
+	result = dict()
+	for line in text.splitlines():
+		if line and not line.startswith('#'):
+			name, value = line.rsplit(' ', 1)
+			result[name] = float(value)
+	return result
+
+
+def test_metrics_server(make_local):
+	local = make_local()
+	port = local.start_metrics_server(host="127.0.0.1", port=0)
+	with urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+		content_type = response.headers["Content-Type"]
+		text = response.read().decode("utf-8")
+	assert content_type.startswith("application/openmetrics-text")
+	assert text.endswith("# EOF\n")
+	assert "# TYPE mypylib_db_saves counter" in text
+	with pytest.raises(HTTPError) as error:
+		urlopen(f"http://127.0.0.1:{port}/other", timeout=5)
+	assert error.value.code == 404
+
+
+def test_cycle_metrics(make_local):
+	local = make_local()
+	stats = local.get_cycle_stats("job")
+	local.try_function(lambda: None, stats=stats)
+	local.try_function(lambda: 1 / 0, stats=stats)
+	samples = parse_samples(local.get_metrics())
+	assert samples['mypylib_cycle_runs_total{cycle="job"}'] == 2
+	assert samples['mypylib_cycle_errors_total{cycle="job"}'] == 1
+	assert samples['mypylib_cycle_duration_seconds_count{cycle="job"}'] == 2
+	assert samples['mypylib_cycle_duration_seconds_bucket{cycle="job",le="+Inf"}'] == 2
+	buckets = [value for name, value in samples.items() if name.startswith("mypylib_cycle_duration_seconds_bucket")]
+	assert buckets == sorted(buckets)
+
+
+def test_db_save_metrics(make_local):
+	local = make_local()
+	local.save_db()
+	local.save_db()
+	samples = parse_samples(local.get_metrics())
+	performed = samples['mypylib_db_saves_total{result="performed"}']
+	skipped = samples['mypylib_db_saves_total{result="skipped"}']
+	assert performed + skipped == 2
+	assert skipped >= 1
+
+
+def test_textfile(make_local, tmp_path):
+	local = make_local()
+	path = tmp_path / "metrics.prom"
+	local.write_metrics(str(path))
+	text = path.read_text()
+	assert text.endswith("# EOF\n")
+	assert re.findall(r"^# TYPE (\S+)", text, re.M) == re.findall(r"^# TYPE (\S+)", local.get_metrics(), re.M)
+
+
+def test_label_escape():
+	assert escape_metric_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_histogram_buckets_grow():
+	values = [get_histogram_bucket_max(index) for index in range(64)]
+	assert values == sorted(set(values))
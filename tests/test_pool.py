@@ -0,0 +1,81 @@
+import threading
+import time
+
+from mypylib import ERROR, INFO
+
+
+def get_errors(local, monkeypatch):
+	errors = list()
+	add_log = local.add_log
+
+	def record(text, mode=INFO, *args, **kwargs):
+		if mode == ERROR:
+			errors.append(text)
+		add_log(text, mode, *args, **kwargs)
+
+	monkeypatch.setattr(local, "add_log", record)
+	return errors
+
+
+def sleep_and_return(item):
+	time.sleep(0.3)
+	return item
+
+
+def test_map_timeout_counts_from_the_task_start(make_local, monkeypatch):
+	local = make_local()
+	local.db.config.threadPoolSize = 2
+	errors = get_errors(local, monkeypatch)
+	assert local.map(sleep_and_return, range(6), timeout=0.5) == list(range(6))
+	time.sleep(0.1)
+	assert errors == []
+
+
+def test_map_gives_none_for_slow_and_failed_tasks(make_local, monkeypatch):
+	local = make_local()
+	errors = get_errors(local, monkeypatch)
+
+	def func(item):
+		if item == 1:
+			time.sleep(0.5)
+		if item == 2:
+			raise ValueError("bad item")
+		return item
+
+	assert local.map(func, range(3), timeout=0.2) == [0, None, None]
+	time.sleep(0.4)
+	assert sorted(errors) == ["func error: bad item", "func error: timeout 0.2 sec"]
+
+
+def test_submit_timeout_is_cancelled_when_the_task_ends(make_local, monkeypatch):
+	local = make_local()
+	local.db.config.threadPoolSize = 1
+	errors = get_errors(local, monkeypatch)
+	futures = [local.submit(sleep_and_return, i, timeout=0.5) for i in range(3)]
+	assert [future.result(5) for future in futures] == [0, 1, 2]
+	time.sleep(0.6)
+	assert errors == []
+	assert all(item[2].cancelled for item in local._scheduler.heap)
+
+
+def test_process_map_timeout(make_local):
+	local = make_local()
+	local.db.config.processPoolSize = 1
+	# The executor marks one task more than it has processes as running
+	assert local.map(sleep_and_return, range(4), timeout=1, process=True) == [0, 1, 2, 3]
+
+
+def test_shutdown_inside_the_pool_lock(make_local):
+	# exit() runs from a signal handler, which may interrupt the main thread inside get_thread_pool()
+	local = make_local()
+	local.submit(time.sleep, 0)
+
+	def interrupted():
+		with local._pool_lock:
+			local.shutdown()
+
+	thread = threading.Thread(target=interrupted, daemon=True)
+	thread.start()
+	thread.join(5)
+	assert not thread.is_alive()
+	assert local._thread_pool is None
@@ -0,0 +1,80 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from mypylib import LogRotator
+
+
+@pytest.fixture
+def make_rotator(make_local, tmp_path):
+	'''LogRotator of its own file, apart from the log of the MyPyClass'''
+	def make(**config):
+		local = make_local()
+		for key, value in config.items():
+			local.db.config[key] = value
+		return LogRotator(local), str(tmp_path / "rotated.log")
+	return make
+
+
+def write_segments(rotator, path, count):
+	for i in range(count):
+		rotator.write(path, f"segment {i}\n" * 2)
+
+
+def wait_compress(rotator):
+	thread = rotator.compress_thread
+	if thread is not None:
+		thread.join(5)
+
+
+def read(path):
+	opener = gzip.open if path.endswith(".gz") else open
+	with opener(path, 'rt') as file:
+		return file.read()
+
+
+def test_rename_chain(make_rotator):
+	rotator, path = make_rotator(logFileSizeLines=1, logRotateCount=3, isCompressLogFile=False)
+	write_segments(rotator, path, 5)
+	assert not os.path.exists(path)
+	assert rotator.get_segments() == [path + ".1", path + ".2", path + ".3"]
+	assert [read(item) for item in rotator.get_segments()] == [f"segment {i}\n" * 2 for i in (4, 3, 2)]
+
+
+def test_compression(make_rotator):
+	rotator, path = make_rotator(logFileSizeLines=1, logRotateCount=3)
+	write_segments(rotator, path, 3)
+	wait_compress(rotator)
+	assert rotator.get_segments() == [path + ".1", path + ".2.gz", path + ".3.gz"]
+	assert [read(item) for item in rotator.get_segments()] == [f"segment {i}\n" * 2 for i in (2, 1, 0)]
+	assert not any(name.endswith(".tmp") for name in os.listdir(os.path.dirname(path)))
+
+
+def test_retention_by_bytes(make_rotator):
+	rotator, path = make_rotator(logFileSizeLines=1, logRotateCount=5, isCompressLogFile=False, logRotateMaxBytes=45)
+	write_segments(rotator, path, 4)
+	assert rotator.get_segments() == [path + ".1", path + ".2"]
+
+
+def test_retention_by_age(make_rotator):
+	rotator, path = make_rotator(logFileSizeLines=1, logRotateCount=5, isCompressLogFile=False, logRotateMaxAge=3600)
+	write_segments(rotator, path, 2)
+	old_time = time.time() - 7200
+	os.utime(path + ".2", (old_time, old_time))
+	write_segments(rotator, path, 1)
+	assert rotator.get_segments() == [path + ".1", path + ".2"]
+
+
+@pytest.mark.skipif(hasattr(os.stat_result, "st_birthtime"), reason="the segment time is the birth time of the file")
+@pytest.mark.parametrize("age, rotated", [(7200, True), (60, False)])
+def test_interval_counts_from_the_segment_start(make_rotator, age, rotated):
+	rotator, path = make_rotator(logRotateInterval=3600, isCompressLogFile=False)
+	first_line = time.strftime("%d.%m.%Y, %H:%M:%S.000 (UTC)", time.gmtime(time.time() - age))
+	with open(path, 'wt') as file:
+		file.write(f"{first_line}  first\n")
+	rotator.write(path, "next\n")
+	assert os.path.exists(path + ".1") is rotated
+	rotator.write(path, "after\n")
+	assert not os.path.exists(path + ".2")
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from mypylib import INFO, WARNING
+
+
+def wait_for(condition, timeout=5):
+	end = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < end, "timed out"
+		time.sleep(0.01)
+
+
+def get_warnings(local, monkeypatch):
+	warnings = list()
+	add_log = local.add_log
+
+	def record(text, mode=INFO, *args, **kwargs):
+		if mode == WARNING:
+			warnings.append(text % args)
+		add_log(text, mode, *args, **kwargs)
+
+	monkeypatch.setattr(local, "add_log", record)
+	return warnings
+
+
+def start_timed_cycle(local, name, duration, **kwargs):
+	starts = list()
+
+	def func():
+		starts.append(time.monotonic())
+		time.sleep(duration)
+
+	job = local.start_cycle(func, name=name, **kwargs)
+	return job, starts
+
+
+def test_fixed_delay_and_fixed_rate(make_local):
+	local = make_local()
+	delay_job, delay_starts = start_timed_cycle(local, "delay", 0.05, sec=0.1)
+	rate_job, rate_starts = start_timed_cycle(local, "rate", 0.05, sec=0.1, mode="rate")
+	time.sleep(1)
+	delay_job.cancel()
+	rate_job.cancel()
+	delay_gaps = [b - a for a, b in zip(delay_starts, delay_starts[1:])]
+	assert min(delay_gaps) >= 0.15
+	assert len(rate_starts) > len(delay_starts)
+
+
+def test_overruns(make_local):
+	local = make_local()
+	job, starts = start_timed_cycle(local, "slow", 0.1, sec=0.02)
+	wait_for(lambda: job.stats.count >= 3)
+	job.cancel()
+	assert job.overruns >= 3
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 2])
+def test_max_concurrency(make_local, max_concurrency):
+	local = make_local()
+	lock = threading.Lock()
+	state = {"running": 0, "max": 0}
+
+	def func():
+		with lock:
+			state["running"] += 1
+			state["max"] = max(state["max"], state["running"])
+		time.sleep(0.2)
+		with lock:
+			state["running"] -= 1
+
+	job = local.start_cycle(func, sec=0.02, mode="rate", max_concurrency=max_concurrency)
+	wait_for(lambda: job.stats.count >= 4)
+	job.cancel()
+	assert state["max"] == max_concurrency
+	assert job.missed > 0
+
+
+def test_stop_latency(make_local):
+	local = make_local()
+	job, starts = start_timed_cycle(local, "idle", 0, sec=60)
+	wait_for(lambda: job.stats.count == 1)
+	scheduler = local._scheduler
+	start = time.monotonic()
+	scheduler.stop()
+	scheduler.thread.join(1)
+	for worker in scheduler.workers:
+		worker.join(1)
+	assert time.monotonic() - start < 0.5
+	assert not scheduler.thread.is_alive()
+	assert not any(worker.is_alive() for worker in scheduler.workers)
+
+
+def test_burst_of_short_cycles_does_not_warn(make_local, monkeypatch):
+	local = make_local()
+	warnings = get_warnings(local, monkeypatch)
+	jobs = [local.start_cycle(lambda: None, name=f"cycle_{i}", sec=0.05) for i in range(21)]
+	time.sleep(1.2)
+	for job in jobs:
+		job.cancel()
+	assert warnings == []
+
+
+def test_backlog_warns_once(make_local, monkeypatch):
+	local = make_local()
+	local.db.config.schedulerMaxWorkers = 1
+	warnings = get_warnings(local, monkeypatch)
+	first, first_starts = start_timed_cycle(local, "first", 0.6, sec=0.01)
+	second, second_starts = start_timed_cycle(local, "second", 0.6, sec=0.01)
+	wait_for(lambda: len(second_starts) >= 2)
+	first.cancel()
+	second.cancel()
+	assert len(warnings) == 1
+	assert "workers are busy" in warnings[0]